@@ -1,676 +1,1593 @@
 import os
+import sys
+import json
+import shutil
+import threading
 import requests
 import csv
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 import time
 import hashlib
+import fnmatch
+import re
+import unicodedata
+import base64
+import gzip
+import zlib
+import html
+import cProfile
+import pstats
+import tracemalloc
+import io
+import random
+import tempfile
+import http.server
+import argparse
+import mimetypes
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows, peak RSS is then not reported
 import qrcode
+import qrcode.image.svg
+import xml.etree.ElementTree as ET
+from PIL import Image, ImageColor, ImageDraw, UnidentifiedImageError, features
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from functools import lru_cache, partial
 from datetime import datetime
+from urllib.parse import quote, unquote, urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    font_subset = None
+    TTFont = None
 
-def get_google_sheet(spreadsheet_id, out_dir):
-    url = f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/gviz/tq?tqx=out:csv'
-    response = requests.get(url)
-    if response.status_code == 200:
-        filepath = os.path.join(out_dir, 'test.csv')
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
-        return filepath
-    else:
-        raise ValueError(f'Google Таблицю не скачано! Зверніться до адміністратора. Код: {response.status_code}')
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEMPLATE_BYTECODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'jinja')
+SHEET_URL = 'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/gviz/tq?tqx=out:csv'
+DEFAULT_SPREADSHEET_ID = '1KUm0d2ieWXLM9iwAGIiIOs2ePDCnApBe88GuRbf3Qr8'
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files')
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+FETCH_WORKERS = 8
+FETCH_CONNECTIONS_PER_HOST = 8
+FETCH_TIMEOUT = (5, 30)  # (connect, read) in seconds
+FETCH_RETRIES = 3
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_SHEET_BYTES = 20 * 1024 * 1024
+MAX_IMAGE_BYTES = 15 * 1024 * 1024
+MAX_VENDOR_BYTES = 5 * 1024 * 1024
+SHEET_CONTENT_TYPES = ('text/csv', 'text/plain', 'application/octet-stream')
+IMAGE_CONTENT_TYPES = ('image/',)  # an HTML error page instead of a logo is rejected before it reaches Pillow
+WATCH_INTERVAL = 60  # seconds between polls of the sheet in watch mode
+QR_WORKERS = os.cpu_count() or 1
+QR_POOL_MIN_BATCH = 32  # smaller batches render faster in-process than it takes to start the pool
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+QR_STYLE = {
+    'version': 1,
+    'error_correction': 'L',
+    'box_size': 10,
+    'border': 0,
+    'fill_color': 'black',
+    'back_color': 'lightgrey',
+}
+LOGO_WIDTHS = (200, 400)  # 200px is the logo width in addLargeStyle, 400px is for 2x screens
+LOGO_FORMATS = ('avif', 'webp', 'png') if features.check('avif') else ('webp', 'png')
+LOGO_SAVE_OPTIONS = {
+    'png': {'optimize': True},
+    'webp': {'quality': 85, 'method': 4},
+    'avif': {'quality': 60},
+}
+LOGO_PLACEHOLDER_SIZE = 12  # px on the longest side; the browser scales it up into a blurred preview
+IMAGE_META_FILENAME = 'image_meta.json'  # size and placeholder per logo content hash, kept in the cache dir
+CatalogueRow = namedtuple('CatalogueRow', [
+    'name', 'type', 'logo_url', 'organiser', 'description', 'eligibility', 'deadlines', 'url', 'comments',
+])
+VENDOR_TAGCLOUD_URL = 'https://cdn.jsdelivr.net/npm/TagCloud@2.2.0/dist/TagCloud.min.js'
+VENDOR_WARNING_IMAGE_URL = 'https://scontent.fiev16-2.fna.fbcdn.net/v/t39.30808-6/382241510_723954793107215_3669528546435362377_n.jpg?_nc_cat=106&ccb=1-7&_nc_sid=6ee11a&_nc_ohc=yFSZBDNekuEQ7kNvgFAmoQp&_nc_zt=23&_nc_ht=scontent.fiev16-2.fna&_nc_gid=A9fE10s3O11_aLoCbrHPNUk&oh=00_AYAQ63ekQYUKsX5bIsBxwU1DQXTkNaQs0I_w-euyclg3jg&oe=67412A62'
+VENDOR_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'NotoSans.ttf')
+PDF_PAGE_SIZE = (595.28, 841.89)  # A4 in points
+PDF_MARGIN = 48
+PDF_LOGO_BOX = (270, 154)
+PDF_QR_SIZE = 154
+PDF_FONT_SIZES = {'name': 22, 'deadlines': 14.5, 'text': 12.5, 'footer': 10.5}
+PDF_LINE_HEIGHT = 1.4
+PDF_JPEG_QUALITY = 85  # for photographic logos, flat ones are embedded losslessly
+PDF_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'pdf')  # laid-out rows and encoded logos
+MANIFEST_FILENAME = 'build_manifest.json'
+TRACE_FILENAME = 'build_trace.json'  # Chrome trace format, open in chrome://tracing or ui.perfetto.dev
+PROFILE_FILENAME = 'build.prof'
+PROFILE_TOP = 25  # functions and allocation sites listed in the profile report
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'bench')
+BENCH_SIZES = (100, 1000, 10000)
+BENCH_LATENCY = 0.05  # seconds the stand-in server waits before every response
+BENCH_LOGO_SIZE = 600  # px, synthetic logos are square noise images
+BENCH_LOGO_COUNT = 100  # distinct logos, rows reuse them like real sheets reuse organisers
+BENCH_VENDOR_URLS = {'tagcloud': '/vendor/TagCloud.min.js', 'warning_image': '/vendor/warning.jpg'}  # paths on the stand-in server
+ASSET_MANIFEST_FILENAME = 'asset-manifest.json'
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8000
+SERVE_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SERVE_COMPRESSED_CACHE_SIZE = 64  # files kept compressed in memory when they have no .br/.gz next to them
+SERVE_RELOAD_POLL = 0.5  # seconds between checks of index.html for a finished rebuild
+SERVE_KEEPALIVE = 15  # seconds between keep-alive comments on an idle live-reload stream
+LIVE_RELOAD_PATH = '/__livereload'
+LIVE_RELOAD_SCRIPT = f"<script>new EventSource('{LIVE_RELOAD_PATH}').addEventListener('reload', () => location.reload());</script>"
+COMPRESSIBLE_EXTENSIONS = ('.html', '.json', '.svg', '.js', '.css')
+HASHED_ASSET_PATTERNS = ('qr_*', 'logo_*', 'image_*', 'details_*', 'search_*', 'vendor_*', 'catalogue_*')
+CLOUD_GROUP_SIZE = 60  # most tags one cloud shows; larger catalogues are grouped by type and paginated
+CLOUD_FALLBACK_GROUP = 'Інше'  # group for rows with an empty type
+SEARCH_COLUMNS = (0, 1, 3, 4)  # name, type, organiser, description; the page ranks them in this order
+GC_PATTERNS = ('qr_*.png', 'qr_*.svg', 'logo_*.png', 'logo_*.webp', 'logo_*.avif', 'image_*', 'details_*.json', 'search_*.json', 'vendor_*', 'catalogue_*.pdf', '*.tmp', '*.gz', '*.br')
+QR_FORMAT = 'png'  # 'png', 'svg' or 'inline' (SVG data URI embedded in the page)
+QR_ERROR_CORRECTION = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+class HttpCache:
+    """On-disk cache of HTTP responses with conditional requests and LRU eviction."""
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES, offline=False):
+        self.cache_dir = cache_dir
+        self.offline = offline  # serve stored responses only, never touch the network
+        self.blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self.entries = {}
+        self.stats = {'hits': 0, 'misses': 0}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.entries = index.get('entries', {})
+            self.stats.update(index.get('stats', {}))
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.blobs_dir, content_hash)
+
+    def fetch_blob(self, session, url, timeout=FETCH_TIMEOUT, max_bytes=None, content_types=None):
+        """Makes sure the body of url is in the blob store; returns the status code and the cache entry (None on failure)."""
+        with self.lock:
+            entry = self.entries.get(url)
+        if self.offline:
+            # Like Cache-Control: only-if-cached, a miss is a 504 instead of a request
+            if not (entry and os.path.exists(self.blob_path(entry['hash']))):
+                return 504, None
+            with self.lock:
+                entry['last_used'] = time.time()
+                self.stats['hits'] += 1
+            return 304, entry
+        headers = {}
+        if entry and os.path.exists(self.blob_path(entry['hash'])):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        with (session or requests).get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and headers:
+                with self.lock:
+                    entry['last_used'] = time.time()
+                    self.stats['hits'] += 1
+                return 304, entry
+            if response.status_code != 200:
+                return response.status_code, None
+            tmp_path, content_hash, size = stream_to_tempfile(response, self.blobs_dir, max_bytes, content_types)
+        # Blobs are named by content, so identical bodies from different URLs are stored once
+        os.replace(tmp_path, self.blob_path(content_hash))
+        entry = {
+            'hash': content_hash,
+            'size': size,
+            'content_type': response.headers.get('Content-Type'),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'last_used': time.time(),
+        }
+        with self.lock:
+            self.entries[url] = entry
+            self.stats['misses'] += 1
+        return 200, entry
+
+    def fetch(self, session, url, dest_path, timeout=FETCH_TIMEOUT, max_bytes=None, content_types=None):
+        """Downloads url into dest_path and returns the status code (304 means served from cache)."""
+        status_code, entry = self.fetch_blob(session, url, timeout=timeout, max_bytes=max_bytes, content_types=content_types)
+        if entry and (status_code == 200 or not (os.path.exists(dest_path) and os.path.getsize(dest_path) == entry['size'])):
+            copy_atomic(self.blob_path(entry['hash']), dest_path)
+        return status_code
+
+    def evict(self):
+        with self.lock:
+            total = sum(entry['size'] for entry in self.entries.values())
+            for url, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used']):
+                if total <= self.max_bytes:
+                    break
+                del self.entries[url]
+                total -= entry['size']
+                if not any(other['hash'] == entry['hash'] for other in self.entries.values()):
+                    try:
+                        os.remove(self.blob_path(entry['hash']))
+                    except FileNotFoundError:
+                        pass
+
+    def save(self):
+        self.evict()
+        with self.lock:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'entries': self.entries, 'stats': self.stats}, f)
+            os.replace(tmp_path, self.index_path)
+
+    def report(self):
+        total = sum(entry['size'] for entry in self.entries.values())
+        requests_count = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / requests_count * 100 if requests_count else 0
+        return (f"Записів у кеші: {len(self.entries)}, розмір: {total / 1024 / 1024:.1f} МБ із {self.max_bytes / 1024 / 1024:.0f} МБ\n"
+                f"Влучань: {self.stats['hits']}, промахів: {self.stats['misses']} ({hit_rate:.0f}% влучань)")
+
+class BuildTrace:
+    """Per-stage and per-item timings of one build, exported as a summary table and a Chrome trace."""
+
+    def __init__(self, origin=None):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.current = None
+
+    def add(self, name, category, start, duration, tid=None, **args):
+        # Work done in a pool worker is shown on a track of its own, named by the worker's process id
+        with self.lock:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6),
+                'dur': round(duration * 1e6),
+                'pid': os.getpid(),
+                'tid': tid if tid is not None else threading.get_ident(),
+                'args': args,
+            })
+
+    def stage(self, name):
+        # Stages run one after another, so starting one closes the previous
+        self.finish()
+        self.current = (name, time.perf_counter())
+
+    def finish(self):
+        if self.current:
+            name, start = self.current
+            self.add(name, 'stage', start, time.perf_counter() - start)
+            self.current = None
+
+    @contextmanager
+    def item(self, name, **args):
+        """Times one unit of work; the caller may add 'status' and 'bytes' to the yielded args."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, 'item', start, time.perf_counter() - start, **args)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def summary(self, slowest=5):
+        items = defaultdict(list)
+        for event in self.events:
+            if event['cat'] == 'item':
+                items[event['name']].append(event)
+        all_items = [event for events in items.values() for event in events]
+        lines = [f"{'Етап':<14}{'мс':>9}{'шт.':>7}{'КБ':>9}{'влучань':>9}{'промахів':>10}"]
+        for event in (event for event in self.events if event['cat'] == 'stage'):
+            children = [child for child in all_items if event['ts'] <= child['ts'] <= event['ts'] + event['dur']]
+            columns = [len(children) or '', '', '', '']
+            if any('status' in child['args'] for child in children):
+                transferred = sum(child['args'].get('bytes', 0) for child in children)
+                hits = sum(1 for child in children if child['args'].get('status') == 304)
+                misses = sum(1 for child in children if child['args'].get('status') == 200)
+                columns = [len(children), f"{transferred / 1024:.0f}", hits, misses]
+            lines.append(f"{event['name']:<14}{event['dur'] / 1000:>9.0f}{columns[0]:>7}{columns[1]:>9}{columns[2]:>9}{columns[3]:>10}".rstrip())
+        hosts = defaultdict(float)
+        for event in items.get('download', ()):
+            hosts[urlsplit(event['args']['url']).hostname or '-'] += event['dur'] / 1000
+        if hosts:
+            lines.append("Найповільніші хости (сумарний час завантаження, мс):")
+            lines.extend(f"{duration:>9.0f}  {host}" for host, duration in sorted(hosts.items(), key=lambda item: -item[1])[:slowest])
+        slow_items = sorted(all_items, key=lambda event: -event['dur'])[:slowest]
+        if slow_items:
+            lines.append("Найдовші операції (мс):")
+            lines.extend(f"{event['dur'] / 1000:>9.0f}  {event['name']} {event['args'].get('row') or event['args'].get('url') or event['args'].get('file', '')}" for event in slow_items)
+        return '\n'.join(lines)
+
+def timed_call(func, arg):
+    # Runs in a pool worker; perf_counter is system-wide, so the start can be placed on the build's timeline
+    start = time.perf_counter()
+    result = func(arg)
+    return result, start, time.perf_counter() - start, os.getpid()
+
+class SharedWork:
+    """Work shared by the builds of one batch: a process pool and deduplication of identical tasks by key."""
+
+    def __init__(self, asset_dir, workers=QR_WORKERS):
+        self.asset_dir = asset_dir
+        self.processes = ProcessPoolExecutor(max_workers=workers)
+        self.futures = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def submit(self, key, submit):
+        # The first build to ask for key schedules it through submit(); the others get the same future
+        with self.lock:
+            self.requests += 1
+            future = self.futures.get(key)
+            if future is None:
+                future = self.futures[key] = submit()
+        return future
+
+    def run(self, key, func):
+        """Runs func in the calling thread unless another build already did or is doing it."""
+        with self.lock:
+            self.requests += 1
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def close(self):
+        self.processes.shutdown()
+
+@contextmanager
+def build_profile(profile_dir, top=PROFILE_TOP):
+    """Opt-in cProfile and tracemalloc around a build; prints the hottest functions and allocation sites."""
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_path = os.path.join(profile_dir, PROFILE_FILENAME)
+        profiler.dump_stats(profile_path)
+        print(f"\nПрофіль збережено в {profile_path}. Найдовші функції (сумарний час):")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(top)
+        print(f"Пік виділеної пам'яті Python: {peak / 1024 / 1024:.1f} МБ. Найбільші місця виділення:")
+        for stat in snapshot.statistics('lineno')[:top]:
+            print(f"  {stat.size / 1024:>9.0f} КБ  {stat.traceback[0].filename}:{stat.traceback[0].lineno}")
+
+@lru_cache(maxsize=None)
+def get_template_environment(bytecode_cache_dir=TEMPLATE_BYTECODE_DIR):
+    # One environment per process: compiled templates stay in its cache, bytecode persists on disk between runs.
+    # auto_reload checks the template files' mtimes, so a long-running watch or serve picks up edits to templates/
+    os.makedirs(bytecode_cache_dir, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir),
+        autoescape=select_autoescape(['html']),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=True,
+    )
+
+def create_session(pool_size=FETCH_CONNECTIONS_PER_HOST, retries=FETCH_RETRIES):
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def stream_to_tempfile(response, directory, max_bytes=None, content_types=None):
+    """Streams a response body into a temp file in directory, hashing it on the way; returns (path, md5, size)."""
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_types and content_type and not content_type.startswith(content_types):
+        raise ValueError(f"Отримано {content_type} замість {', '.join(content_types)}")
+    declared_size = response.headers.get('Content-Length', '')
+    if max_bytes and declared_size.isdigit() and int(declared_size) > max_bytes:
+        raise ValueError(f"Файл завеликий: {int(declared_size) / 1024 / 1024:.1f} МБ, можна до {max_bytes / 1024 / 1024:.0f} МБ")
+    hash_md5 = hashlib.md5()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise ValueError(f"Файл завеликий: понад {max_bytes / 1024 / 1024:.0f} МБ")
+                hash_md5.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, hash_md5.hexdigest(), size
+
+def link_or_copy(source_path, dest_path):
+    # Hard links keep one copy of shared assets on disk; copies are the fallback across file systems
+    tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)
 
-def download_image(url, output_dir):
+def copy_atomic(source_path, dest_path):
+    tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+    shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+def image_filename(content_hash, url, content_type=None):
+    # Named by content, so two URLs with the same basename no longer overwrite each other
+    extension = os.path.splitext(urlsplit(url).path)[1].lower()
+    if not extension:
+        extension = mimetypes.guess_extension((content_type or '').split(';')[0].strip()) or ''
+    return f"image_{content_hash[:16]}{extension}"
+
+def get_google_sheet(spreadsheet_id, out_dir, session=None, timeout=FETCH_TIMEOUT, cache=None, trace=None, sheet_url=SHEET_URL):
+    url = sheet_url.format(spreadsheet_id=spreadsheet_id)
+    filepath = os.path.join(out_dir, 'test.csv')
+    trace = trace or BuildTrace()
+    with trace.item('sheet', url=url) as event:
+        if cache is not None:
+            status_code = event['status'] = cache.fetch(session, url, filepath, timeout=timeout,
+                                                        max_bytes=MAX_SHEET_BYTES, content_types=SHEET_CONTENT_TYPES)
+            if status_code in (200, 304):
+                event['bytes'] = os.path.getsize(filepath) if status_code == 200 else 0
+                return filepath
+            raise ValueError(f'Google Таблицю не скачано! Зверніться до адміністратора. Код: {status_code}')
+        with (session or requests).get(url, timeout=timeout, stream=True) as response:
+            event['status'] = response.status_code
+            if response.status_code == 200:
+                tmp_path, _, event['bytes'] = stream_to_tempfile(response, out_dir, MAX_SHEET_BYTES, SHEET_CONTENT_TYPES)
+                os.replace(tmp_path, filepath)
+                return filepath
+            else:
+                raise ValueError(f'Google Таблицю не скачано! Зверніться до адміністратора. Код: {response.status_code}')
+
+def download_image(url, output_dir, session=None, timeout=FETCH_TIMEOUT, cache=None, trace=None):
+    if not url:
+        return None  # already reported by load_catalogue
+    trace = trace or BuildTrace()
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            image_filename = os.path.basename(url)
-            image_path = os.path.join(output_dir, image_filename)
-            with open(image_path, 'wb') as f:
-                f.write(response.content)
-            return image_filename
+        with trace.item('download', url=url) as event:
+            event['bytes'] = 0
+            if cache is not None:
+                status_code, entry = cache.fetch_blob(session, url, timeout=timeout, max_bytes=MAX_IMAGE_BYTES, content_types=IMAGE_CONTENT_TYPES)
+                if entry:
+                    filename = image_filename(entry['hash'], url, entry.get('content_type'))
+                    if not os.path.exists(os.path.join(output_dir, filename)):
+                        copy_atomic(cache.blob_path(entry['hash']), os.path.join(output_dir, filename))
+                    if status_code == 200:
+                        event['bytes'] = entry['size']
+            else:
+                with (session or requests).get(url, timeout=timeout, stream=True) as response:
+                    status_code = response.status_code
+                    if status_code == 200:
+                        tmp_path, content_hash, event['bytes'] = stream_to_tempfile(response, output_dir, MAX_IMAGE_BYTES, IMAGE_CONTENT_TYPES)
+                        filename = image_filename(content_hash, url, response.headers.get('Content-Type'))
+                        os.replace(tmp_path, os.path.join(output_dir, filename))
+            event['status'] = status_code
+        if status_code in (200, 304):
+            return filename
         else:
-            print(f"Картинку не скачано! Користуйтеся i.ibb.co, інакше зверніться до адміністратора. Код: {response.status_code}")
+            print(f"Картинку не скачано! Користуйтеся i.ibb.co, інакше зверніться до адміністратора. Код: {status_code}")
             return None
     except Exception as e:
         print(f"Опис помилки, яка сталася при скачуванні картинки: {str(e)}")
         return None
 
-def generate_html_from_csv(csv_filepath, output_dir):
-    with open(csv_filepath, 'r', encoding='utf-8') as csvfile:
+def download_images(image_urls, output_dir, session=None, max_workers=FETCH_WORKERS, cache=None, trace=None, shared=None):
+    unique_urls = list(dict.fromkeys(image_urls))
+    own_session = session is None
+    if own_session:
+        session = create_session()
+    def fetch(url):
+        start = time.perf_counter()
+        download = partial(download_image, url, output_dir, session=session, cache=cache, trace=trace)
+        filename = shared.run(('download', output_dir, url), download) if shared else download()
+        return url, filename, time.perf_counter() - start
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url, filename, elapsed in executor.map(fetch, unique_urls):
+                results[url] = filename
+                print(f"{elapsed * 1000:8.0f} мс  {url}")
+    finally:
+        if own_session:
+            session.close()
+    return results
+
+def parse_header_schema(headers):
+    # Headers look like "✅ НАЗВА (ПРОГРАМИ ТОЩО) /80/ [0]"; the number after the slash is the length limit
+    schema = []
+    for header in headers:
+        limit = re.search(r'/(\d+)', header)
+        schema.append(int(limit.group(1)) if limit else None)
+    return schema
+
+def iter_catalogue_rows(csv_filepath, errors, warnings):
+    # Streams the sheet row by row, recording problems instead of stopping at the first one
+    with open(csv_filepath, 'r', encoding='utf-8', newline='') as csvfile:
         reader = csv.reader(csvfile)
-        headers = next(reader)
-        rows = [row for row in reader]
+        headers = next(reader, None)
+        if headers is None:
+            errors.append("таблиця порожня")
+            return
+        if len(headers) < len(CatalogueRow._fields):
+            errors.append(f"у заголовку {len(headers)} стовпчиків замість {len(CatalogueRow._fields)}")
+            return
+        limits = parse_header_schema(headers)[:len(CatalogueRow._fields)]
+        for line_number, row in enumerate(reader, start=2):
+            if not any(cell.strip() for cell in row):
+                continue
+            if len(row) < len(CatalogueRow._fields):
+                errors.append(f"рядок {line_number}: {len(row)} стовпчиків замість {len(CatalogueRow._fields)}")
+                continue
+            record = CatalogueRow(*row[:len(CatalogueRow._fields)])
+            if not record.name.strip():
+                errors.append(f"рядок {line_number}: порожня назва (стовпчик 0)")
+            if record.logo_url and not record.logo_url.startswith(('http://', 'https://')):
+                errors.append(f"рядок {line_number}: посилання на лого не схоже на адресу (стовпчик 2)")
+            elif not record.logo_url:
+                warnings.append(f"рядок {line_number}: немає лого (стовпчик 2)")
+            if not record.url.startswith(('http://', 'https://')):
+                errors.append(f"рядок {line_number}: посилання на сайт не схоже на адресу (стовпчик 7)")
+            for column, (value, limit) in enumerate(zip(record, limits)):
+                if limit and len(value) > limit:
+                    warnings.append(f"рядок {line_number}: стовпчик {column} довший за {limit} символів ({len(value)})")
+            yield record
+
+def load_catalogue(csv_filepath):
+    errors = []
+    warnings = []
+    rows = list(iter_catalogue_rows(csv_filepath, errors, warnings))
+    for warning in warnings:
+        print(f"Увага, {warning}")
+    if errors:
+        raise ValueError("Таблицю заповнено з помилками, сайт не згенеровано:\n" + "\n".join(errors))
+    return rows
+
+def generate_html_from_csv(csv_filepath, output_dir, session=None, cache=None, qr_workers=QR_WORKERS, qr_format=QR_FORMAT, quarantine_dir=None, shard_size=None, pdf=True, trace=None, fetch_workers=FETCH_WORKERS, shared=None, vendor_urls=None):
+    trace = trace or BuildTrace()
+    # In a batch, images, logo variants and QR codes are produced once in a shared store and linked into each site
+    asset_dir = shared.asset_dir if shared else output_dir
+    trace.stage('load')
+    rows = load_catalogue(csv_filepath)
     total_rows = len(rows)
-    my_tags = []
-    tag_descriptions = {}
-    tag_bottom_descriptions = {}  # New dictionary for column 5
-    tag_column_6_descriptions = {}  # New dictionary for column 6
-    qr_codes = {}
-    urls = {}
-    images = {}
-    footer_texts = {}  # New dictionary for column 8
+    records = []
     edition_date = datetime.now().strftime("%d.%m.%Y, %H:%M")
+    output_html_path = os.path.join(output_dir, 'index.html')
+    trace.stage('diff')
+    previous_manifest = load_build_manifest(output_dir)
+    settings = build_settings_key(qr_format)
+    previous_rows = previous_manifest.get('rows', {}) if previous_manifest.get('settings') == settings else {}
+    keys = row_keys(rows)
+    row_hashes = {key: row_hash(row) for key, row in zip(keys, rows)}
+    row_assets = {
+        name: entry for name, entry in previous_rows.items()
+        if row_hashes.get(name) == entry['hash'] and row_assets_exist(entry, output_dir)
+    }
+    added, changed, removed = diff_build_manifest(previous_rows, row_hashes)
+    print(f"Нових рядків: {len(added)}, змінених: {len(changed)}, видалених: {len(removed)}, без змін: {len(row_assets)}.")
+    for label, names in (('+', added), ('~', changed), ('-', removed)):
+        for name in names:
+            print(f"  {label} {name}")
+    order = keys
+    page = {'shard_size': shard_size, 'pdf': pdf, 'sources': build_page_key()}
+    pending_rows = [(key, row) for key, row in zip(keys, rows) if key not in row_assets]
+    previous_pdf = previous_manifest.get('pdf')
+    pdf_exists = not previous_pdf or os.path.exists(os.path.join(output_dir, previous_pdf))
+    # A vendor file that fell back to its external URL is fetched again on the next build
+    previous_vendor = previous_manifest.get('vendor', {})
+    vendor_ready = previous_vendor.get('complete') and all(os.path.exists(os.path.join(output_dir, filename)) for filename in previous_vendor['files'])
+    if not pending_rows and order == previous_manifest.get('order') and page == previous_manifest.get('page') and pdf_exists and vendor_ready and os.path.exists(output_html_path):
+        print("Змін у таблиці немає, index.html не перезаписується.")
+        trace.finish()
+        return
+    trace.stage('download')
+    if pending_rows:
+        print(f"Скачуються картинки ({len(set(row.logo_url for _, row in pending_rows))} шт.)...")
+    downloaded_images = download_images([row.logo_url for _, row in pending_rows], asset_dir, session=session, max_workers=fetch_workers, cache=cache, trace=trace, shared=shared)
+    trace.stage('logos')
+    image_meta_path = os.path.join(cache.cache_dir, IMAGE_META_FILENAME) if cache is not None else None
+    image_meta = load_image_meta(image_meta_path)
+    optimized_logos = optimize_logos(downloaded_images.values(), asset_dir, workers=qr_workers, trace=trace, shared=shared, image_meta=image_meta)
+    save_image_meta(image_meta_path, image_meta)
+    trace.stage('qr')
+    rendered_qr_codes = render_qr_codes([row.url for _, row in pending_rows], asset_dir, workers=qr_workers, fmt=qr_format, shared=shared,
+                                        trace=trace, names={row.url: row.name for _, row in pending_rows})
+    for key, row in pending_rows:
+        row_assets[key] = {
+            'hash': row_hashes[key],
+            'image': downloaded_images[row.logo_url],
+            'logo': optimized_logos.get(downloaded_images[row.logo_url]),
+            'qr': rendered_qr_codes[row.url],
+        }
+    if asset_dir != output_dir:
+        for filename in live_assets(row_assets[key] for key, _ in pending_rows):
+            if not os.path.exists(os.path.join(output_dir, filename)):
+                link_or_copy(os.path.join(asset_dir, filename), os.path.join(output_dir, filename))
+    trace.stage('records')
     for index, row in enumerate(rows):
-        my_tags.append(row[0])
-        tag_descriptions[row[0]] = row[4]
-        tag_bottom_descriptions[row[0]] = row[5]  # Add column 5 data
-        tag_column_6_descriptions[row[0]] = row[6].upper()  # Convert column 6 data to upper case and bold
-        qr_codes[row[0]] = generate_qr_code(row[7], output_dir)
-        urls[row[0]] = row[7]
-        images[row[0]] = download_image(row[2], output_dir)
-        footer_texts[row[0]] = row[8]  # Add column 8 data
+        assets = row_assets[keys[index]]
+        srcset = assets['logo']['srcset'] if assets['logo'] else {}
+        records.append({
+            'name': row.name,
+            'description': row.description,
+            'eligibility': row.eligibility,
+            'deadlines': row.deadlines.upper(),
+            'qr': assets['qr'],
+            'url': row.url,
+            'image': assets['logo']['src'] if assets['logo'] else assets['image'],
+            'footer': row.comments,
+            **{field: assets['logo'].get(field) if assets['logo'] else None for field in ('width', 'height', 'color', 'placeholder')},
+            **{f'srcset_{fmt}': srcset.get(fmt) for fmt in LOGO_FORMATS},
+        })
         print(f"Опрацьовується рядок {index + 1} із {total_rows}.\nЛишилося рядків - {total_rows - (index + 1)}.\n")
 
-    template_string = """
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Хмара можливостей</title>
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@100..900&display=swap');
-        html {
-            font-family: 'Montserrat', sans-serif;
-            height: 100%;
-            margin: 0;
-        }
-        body {
-            display: flex;
-            flex-direction: column;
-            height: 100vh;
-            margin: 0;
-            overflow: hidden;
-        }
-        .edition-banner {
-            position: absolute;
-            top: 20px;
-            left: 20px;
-            width: 250px;
-            height: 50px;
-            background-color: #b80000;
-            color: white;
-            opacity: 0.9;
-            border-radius: 25px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 18px;
-            font-family: 'Montserrat', sans-serif;
-        }
-        .pdf-download {
-            position: absolute;
-            top: 80px;
-            left: 20px;
-            width: 250px;
-            height: 85px;
-            background-color: black;
-            color: white;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 18px;
-            border-radius: 25px;
-        }
-        .content-container {
-            display: flex;
-            flex: 1;
-            margin: 0 2.5vw;
-            align-items: stretch;
-            box-sizing: border-box;
-        }
-        .tagcloud {
-            flex: 1;
-            display: flex;
-            justify-content: flex-start;
-            align-items: center;
-            position: relative;
-            overflow: visible;
-            min-height: 80vh;
-            transition: opacity 0.3s ease; /* Transition for opacity */
-        }
-        .description {
-            width: 50%;
-            height: 80%;
-            display: flex;
-            flex-direction: column;
-            justify-content: space-between;
-            padding: 10px;
-            box-sizing: border-box;
-        }
-        .description-top {
-            white-space: pre-wrap;
-            flex-grow: 1;
-            overflow: auto;
-            font-size: 200%;
-        }
-        .description-bottom {
-            background-color: #bae1ff;
-            height: 20%;
-            border-radius: 30px;
-            border: 5px dashed #b80000;
-            display: none; 
-            white-space: pre-wrap;
-            overflow: auto;
-            font-size: 150%; 
-            font-weight: bold; /* Bold text */
-            text-align: center; /* Center aligned */
-            padding: 20px; 
-            align-items: center;
-            justify-content: center;
-        }
-        .description-column-6 {
-            display: none;
-            font-size: 150%; 
-            font-weight: bold; /* Bold text */
-            padding-bottom: 10px; /* Added bottom padding */
-            word-wrap: break-word; /* Ensure text wraps to new lines */
-        }
-        .footer {
-            width: 100%;
-            height: 20%;
-            background-color: lightgrey;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            padding: 0 2%;
-            box-sizing: border-box;
-            position: fixed;
-            bottom: 0;
-        }
-        .footer input {
-            width: calc(50% - 100px);
-            height: 50%;
-            margin-right: 10px;
-            border-radius: 50px;
-            font-family: 'Montserrat', sans-serif;
-            font-size: 150%;
-            padding: 10px;
-            box-sizing: border-box;
-        }
-        .dropdown {
-            white-space: nowrap;
-            position: absolute;
-            background: white;
-            border: 1px solid #ccc;
-            z-index: 10;
-            max-height: 50vh;
-            overflow-y: auto; /* Allow scrolling */
-            width: calc(50% - 100px);
-            font-size: 150%;
-            font-family: 'Montserrat', sans-serif;
-            display: none;
-            bottom: 90%;
-            border-radius: 50px;
-            box-sizing: border-box;
-        }
-        .dropdown::-webkit-scrollbar {
-            width: 0; 
-            background: transparent; 
-        }
-        .dropdown {
-            scrollbar-width: thin;
-            scrollbar-color: transparent transparent;
-        }
-        .dropdown-item {
-            padding: 10px;
-            cursor: pointer;
-            white-space: nowrap;
-            overflow-x: hidden;
-        }
-        .dropdown-item:hover, .dropdown-item.selected {
-            background-color: #b4d7e0;
-        }
-        a {
-            text-decoration: none;
-            color: inherit;
-        }
-        a:visited {
-            color: inherit;
-        }
-        .tagcloud span {
-            transition: opacity 1s ease, font-size 1s ease, transform 0.5s ease;
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            justify-content: flex-start;
-        }
-        .bold {
-            font-weight: bold;
-        }
-        .large {
-            font-size: 3.5vh;
-        }
-        #qr-code {
-            height: 7em;
-            width: 7em;
-            display: none;
-        }
-        #image-display {
-            display: none;
-            width: 0px;
-            height: 0px;
-        }
-         @media (max-width: 1470px), (max-height: 853px) {
-            .content-container {
-                flex-direction: column;
-                padding-bottom: 0;
-            }
-            .tagcloud, .description {
-                width: 100%;
-                height: auto;
-            }
-            .description-bottom {
-                height: auto;
-            }
-            .footer {
-                height: auto;
-                flex-direction: column;
-                align-items: center;
-            }
-        }
-        .resolution-warning {
-            display: none;
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            font-size: 24px;
-            color: red;
-            text-align: center;
-            width: 100%;
-        }
-        .resolution-warning img {
-            width: 50%;
-            height: 50%;
-            object-fit: contain;
-        }
-        @media (max-width: 1470px), (max-height: 853px) {
-            .content-container, .edition-banner, .pdf-download, .footer {
-                display: none;
-            }
-            .resolution-warning {
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-                justify-content: center;
-            }
-            .resolution-warning .warning-image {
-                width: 50%;
-                height: auto;
-                margin-bottom: 20px;
-            }
-            .resolution-warning .warning-text {
-                font-size: 24px;
-                color: red;
-                text-align: center;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="edition-banner">Версія {{ edition_date }}</div>
-    <div class="pdf-download">Скачати pdf (у розробці)</div> <!--Зберегти як PDF-файл-->
-    <div class="content-container">
-        <div class="tagcloud"></div>
-        <div class="description">
-            <pre class="description-top" id="tag-description-top">Скористайтеся хмарою можливостей <b><a href="https://chat.whatsapp.com/Ip2RBXXucyUFvNB1ysAzMZ">команди грантової підтримки</a></b><br><br>Просто натисніть на те, що Вас зацікавило зліва<br><br>Або введіть свій запит у полі нижче, якщо знаєте, що шукаєте<br><br><br><br><b><u>Важлива примітка</u>:<br><i>майже все тут клікабельне (QR-коди в тому числі)</i> 😉</b></pre>
-            <p class="description-column-6" id="tag-description-column-6"></p>
-            <div class="description-bottom" id="tag-description-bottom"></div>
-        </div>
-    </div>
-    <div class="footer">
-        <div id="dropdown" class="dropdown"></div>
-        <input type="text" id="search-input" placeholder="Мені потрібна ця конкретна можливість...">
-        <div id="footer-text" style="overflow-y:hidden;width:33%;height:65%;vertical-align: middle;text-align:right; justify-content: flex-end; font-size: 150%; padding-right: 20px; margin-left: auto;color:#b80000; display: flex; align-items: center; justify-content: center;"></div>
-        <a id="qr-link" href="" target="_blank">
-            <img id="qr-code" src="" alt="QR Code">
-        </a>
-    </div>
-    <img id="image-display" src="" style="display:none;"/>
-    <div class="resolution-warning">
-        <div class="warning-image">
-            <img src="https://scontent.fiev16-2.fna.fbcdn.net/v/t39.30808-6/382241510_723954793107215_3669528546435362377_n.jpg?_nc_cat=106&ccb=1-7&_nc_sid=6ee11a&_nc_ohc=yFSZBDNekuEQ7kNvgFAmoQp&_nc_zt=23&_nc_ht=scontent.fiev16-2.fna&_nc_gid=A9fE10s3O11_aLoCbrHPNUk&oh=00_AYAQ63ekQYUKsX5bIsBxwU1DQXTkNaQs0I_w-euyclg3jg&oe=67412A62" alt="Warning Image">
-        </div>
-        <div class="warning-text">
-            Перепрошуємо, але Ви переглядаєте сайт у замалому розширенні. Збільшіть розмір вікна або зайдіть із іншого пристрою
-        </div>
-    </div>
-    <script src="https://cdn.jsdelivr.net/npm/TagCloud@2.2.0/dist/TagCloud.min.js"></script>
-    <script>
-        const myTags = {{ my_tags | tojson }};
-        const tagDescriptions = {{ tag_descriptions | tojson }};
-        const tagBottomDescriptions = {{ tag_bottom_descriptions | tojson }};  // New variable for column 5
-        const tagColumn6Descriptions = {{ tag_column_6_descriptions | tojson }};  // New variable for column 6
-        const qrCodes = {{ qr_codes | tojson }};
-        const urls = {{ urls | tojson }};
-        const images = {{ images | tojson }};
-        const footerTexts = {{ footer_texts | tojson }};  // New variable for column 8
-        const colors = ['#b80000', '#214d96', '#000000'];
-        let tagCloud = TagCloud('.tagcloud', myTags, {
-            radius: 300,
-            maxSpeed: 'fast',
-            initSpeed: 'fast',
-            direction: 135,
-            keep: true
-        });
-        let isPaused = false;
-        let currentClickedTag = null;
-        let originalPositions = {};
-        let originalDescription = "Скористайтеся хмарою можливостей <b><a href='https://chat.whatsapp.com/Ip2RBXXucyUFvNB1ysAzMZ'>команди грантової підтримки</a></b><br><br>Просто натисніть на те, що Вас зацікавило зліва<br><br>Або введіть свій запит у полі нижче, якщо знаєте, що шукаєте<br><br><br><br><b><u>Важлива примітка</u>:<br><i>майже все тут клікабельне (QR-коди в тому числі) 😉</i></b>";
-        let selectedDropdownIndex = -1; 
-        function showImage(tag) {
-            const imgElement = document.getElementById('image-display');
-            imgElement.src = images[tag.textContent];
-            imgElement.style.display = 'block';
-            const cloudCenter = document.querySelector('.tagcloud').getBoundingClientRect();
-            const centerX = cloudCenter.left + 10; 
-            const centerY = cloudCenter.top + cloudCenter.height * 0.6; 
-            imgElement.style.left = `${centerX}px`;
-            imgElement.style.top = `${centerY}px`; 
-            imgElement.style.position = 'absolute';
-            imgElement.style.zIndex = '10';
-        }
-        function hideImage() {
-            const imgElement = document.getElementById('image-display');
-            imgElement.style.display = 'none';
-        }
-        function toggleTagCloudRotation(tag) {
-            if (isPaused) {
-                tagCloud.resume(); 
-                resetTagsOpacity();
-                removeBoldStyle();
-                removeLargeStyle();
-                resetTagPosition();
-                hideImage();  
-                document.getElementById('tag-description-top').innerHTML = originalDescription;
-                document.getElementById('qr-code').style.display = 'none';
-                document.getElementById('tag-description-bottom').style.display = 'none'; // Hide description-bottom
-                document.getElementById('tag-description-column-6').style.display = 'none'; // Hide column 6 description
-                document.getElementById('footer-text').innerHTML = ''; // Clear footer text
-            } else {
-                tagCloud.pause(); 
-                hideOtherTags(tag);
-                addBoldStyle(tag);
-                addLargeStyle(tag);
-                moveTagToLeft(tag);
-                const qrCode = qrCodes[tag.textContent];
-                const url = urls[tag.textContent];
-                document.getElementById('qr-code').src = qrCode; 
-                document.getElementById('qr-code').style.display = 'block'; 
-                document.getElementById('qr-link').href = url;
-                showImage(tag);
-                setTagWidth(tag);
-                document.getElementById('tag-description-bottom').style.display = 'flex'; // Show description-bottom
-                document.getElementById('tag-description-bottom').innerHTML = tagBottomDescriptions[tag.textContent];  // Set column 5 data
-                document.getElementById('tag-description-column-6').style.display = 'flex'; // Show column 6 description
-                document.getElementById('tag-description-column-6').innerHTML = tagColumn6Descriptions[tag.textContent];  // Set column 6 data
-                document.getElementById('footer-text').innerHTML = footerTexts[tag.textContent];  // Set column 8 data
-            }
-            isPaused = !isPaused;
-            currentClickedTag = isPaused ? tag : null;
-        }
-        function hideOtherTags(selectedTag) {
-            document.querySelectorAll('.tagcloud span').forEach(tag => {
-                if (tag !== selectedTag) {
-                    tag.style.opacity = '0';
-                }
-            });
-            const description = tagDescriptions[selectedTag.textContent];
-            document.getElementById('tag-description-top').innerHTML = description;
-        }
-        function resetTagsOpacity() {
-            document.querySelectorAll('.tagcloud span').forEach(tag => {
-                tag.style.opacity = '1';
-            });
-        }
-        function addBoldStyle(tag) {
-            tag.classList.add('bold');
-        }
-        function removeBoldStyle() {
-            document.querySelectorAll('.tagcloud span').forEach(tag => {
-                tag.classList.remove('bold');
-            });
-        }
-        function addLargeStyle(tag) {
-            tag.classList.add('large');
-            tag.style.display = 'flex';
-            tag.style.alignItems = 'center';
-            const imgElement = tag.querySelector('img');
-            if (imgElement) {
-                imgElement.style.width = '200px'; 
-                imgElement.style.height = 'auto'; 
-            }
-        }
-        function removeLargeStyle() {
-            document.querySelectorAll('.tagcloud span').forEach(tag => {
-                tag.classList.remove('large');
-                tag.style.display = 'inline';  // Reset display
-                const imgElement = tag.querySelector('img');
-                if (imgElement) {
-                    imgElement.style.width = '0px'; 
-                    imgElement.style.height = '0px'; 
-                }
-            });
-        }
-        function moveTagToLeft(tag) {
-            tag.style.transform = 'translate(-50%, -50%) scale(1.5)'; 
-        }
-        function resetTagPosition() {
-            document.querySelectorAll('.tagcloud span').forEach(tag => {
-                tag.style.transform = originalPositions[tag.textContent];
-            });
-        }
-        function setTagWidth(tag) {
-            const tagCloudWidth = document.querySelector('.tagcloud').offsetWidth;
-            tag.style.width = `${tagCloudWidth * 0.65}px`;
-        }
-        setInitialColor();
-        setInterval(updateTagColors, 5000); 
-        function setInitialColor() {
-            document.querySelectorAll('.tagcloud span').forEach((tag, index) => {
-                tag.style.color = colors[index % colors.length];
-                originalPositions[tag.textContent] = tag.style.transform; 
-                const imgElement = document.createElement('img');
-                imgElement.src = images[tag.textContent];
-                imgElement.style.width = '0px'; 
-                imgElement.style.height = '0px';
-                imgElement.style.marginRight = '5px';
-                tag.insertBefore(imgElement, tag.firstChild); 
-            });
-        }
-        function updateTagColors() {
-            document.querySelectorAll('.tagcloud span').forEach((tag, index) => {
-                if (!tag.classList.contains('bold')) {
-                    tag.style.color = colors[Math.floor(Math.random() * colors.length)];
-                }
-            });
-        }
-        const searchInput = document.getElementById('search-input');
-        const dropdown = document.getElementById('dropdown');
-        let isMouseHovering = false; 
-        searchInput.addEventListener('input', function(event) {
-            const inputValue = this.value.toLowerCase();
-            dropdown.innerHTML = '';
-            selectedDropdownIndex = -1; // Reset index
-            const lastChar = event.data; // Get the last character input
-            if (lastChar && /^[a-zA-Z0-9!?.]/.test(lastChar)) { 
-                const matchingTags = myTags.filter(tag => tag.toLowerCase().includes(inputValue));
-                if (matchingTags.length === 1) {
-                    const matchedTag = matchingTags[0];
-                    if (searchInput.value !== matchedTag) {
-                        searchInput.value = matchedTag; 
-                        selectTag(matchedTag); // Automatically select if it's the only match
-                    }
-                    dropdown.style.display = 'none';
-                } else if (matchingTags.length > 1) {
-                    matchingTags.forEach(tag => {
-                        const item = document.createElement('div');
-                        item.classList.add('dropdown-item');
-                        item.textContent = tag;
-                        item.addEventListener('mouseenter', () => {
-                            resetDropdownSelection();
-                            item.classList.add('selected');
-                            isMouseHovering = true; 
-                            selectedDropdownIndex = -1; 
-                        });
-                        item.addEventListener('mouseleave', () => {
-                            item.classList.remove('selected');
-                        });
-                        item.addEventListener('click', () => {
-                            selectTag(tag);
-                        });
-                        dropdown.appendChild(item);
-                    });
-                    dropdown.style.display = 'block';
-                    document.querySelector('.tagcloud').style.opacity = '0'; 
-                } else {
-                    dropdown.style.display = 'none';
-                }
-            } else {
-                dropdown.style.display = 'none';
-                document.querySelector('.tagcloud').style.opacity = '1';
-            }
-        });
-        searchInput.addEventListener('input', function() {
-            if (this.value === '') {
-                if (isPaused) { 
-                    toggleTagCloudRotation(currentClickedTag);
-                }
-            }
-        });
-        searchInput.addEventListener('keydown', (event) => {
-            if (['Backspace', 'Delete'].includes(event.key)) {
-                dropdown.style.display = 'none';
-            }
-        });
-        searchInput.addEventListener('focus', () => {
-            dropdown.style.display = ''; 
-        });
-        searchInput.addEventListener('keydown', (event) => {
-            const items = dropdown.querySelectorAll('.dropdown-item');
-            if (isMouseHovering) {
-                return;
-            }
-            if (event.key === 'ArrowDown') {
-                selectedDropdownIndex = Math.min(selectedDropdownIndex + 1, items.length - 1);
-                resetDropdownSelection(); // Clear previous selections
-                items[selectedDropdownIndex].classList.add('selected');
-                event.preventDefault();
-            } else if (event.key === 'ArrowUp') {
-                selectedDropdownIndex = Math.max(selectedDropdownIndex - 1, 0);
-                resetDropdownSelection(); // Clear previous selections
-                items[selectedDropdownIndex].classList.add('selected');
-                event.preventDefault();
-            } else if (event.key === 'Enter') {
-                if (selectedDropdownIndex >= 0) {
-                    selectTag(items[selectedDropdownIndex].textContent);
-                }
-            }
-        });
-        function resetDropdownSelection() {
-            const items = dropdown.querySelectorAll('.dropdown-item');
-            items.forEach(item => {
-                item.classList.remove('selected');
-            });
-        }
-        searchInput.addEventListener('blur', () => {
-            isMouseHovering = false; // Reset when the input loses focus
-        });
-        searchInput.addEventListener('focus', () => {
-            if (dropdown.innerHTML) {
-                dropdown.style.display = 'block';
-            }
-        });
-        searchInput.addEventListener('blur', () => {
-            setTimeout(() => {
-                dropdown.style.display = 'none';
-                document.querySelector('.tagcloud').style.opacity = '1'; // Reset tag cloud opacity
-            }, 200);
-        });
-        searchInput.addEventListener('keydown', (event) => {
-            const items = dropdown.querySelectorAll('.dropdown-item');
-            if (event.key === 'ArrowDown') {
-                selectedDropdownIndex = Math.min(selectedDropdownIndex + 1, items.length - 1);
-                updateDropdownSelection(items);
-                event.preventDefault(); 
-            } else if (event.key === 'ArrowUp') {
-                selectedDropdownIndex = Math.max(selectedDropdownIndex - 1, 0);
-                updateDropdownSelection(items);
-                event.preventDefault(); 
-            } else if (event.key === 'Enter') {
-                if (selectedDropdownIndex >= 0) {
-                    selectTag(items[selectedDropdownIndex].textContent);
-                }
-            }
-        });
-        function updateDropdownSelection(items) {
-            items.forEach((item, index) => {
-                item.classList.toggle('selected', index === selectedDropdownIndex);
-            });
-            if (selectedDropdownIndex >= 0) {
-                const selectedItem = items[selectedDropdownIndex];
-                const dropdownHeight = dropdown.offsetHeight;
-                const selectedItemHeight = selectedItem.offsetHeight;
-                const selectedItemTop = selectedItem.offsetTop;
-                if (selectedItemTop < dropdown.scrollTop) {
-                    dropdown.scrollTop = selectedItemTop; 
-                } else if (selectedItemTop + selectedItemHeight > dropdown.scrollTop + dropdownHeight) {
-                    dropdown.scrollTop = selectedItemTop + selectedItemHeight - dropdownHeight; 
-                }
-            }
-        }
-        function selectTag(tag) {
-            searchInput.value = tag;
-            dropdown.innerHTML = '';
-            dropdown.style.display = 'none';
-            const selectedTagElement = [...document.querySelectorAll('.tagcloud span')].find(t => t.textContent === tag);
-            if (selectedTagElement) {
-                toggleTagCloudRotation(selectedTagElement);
-            }
-            document.querySelector('.tagcloud').style.opacity = '1'; // Reset tag cloud opacity
-        }
-        document.querySelectorAll('.tagcloud span').forEach(tag => {
-            tag.addEventListener('click', (event) => {
-                const clickedTag = event.currentTarget;
-                if (currentClickedTag === clickedTag) {
-                    toggleTagCloudRotation(null);
-                } else {
-                    toggleTagCloudRotation(clickedTag);
-                }
-            });
-        });
-    </script>
-</body>
-</html>
-    """
-    rendered_html = Template(template_string).render(
-        my_tags=my_tags,
-        tag_descriptions=tag_descriptions,
-        tag_bottom_descriptions=tag_bottom_descriptions,  # Pass column 5 data to the template
-        tag_column_6_descriptions=tag_column_6_descriptions,  # Pass column 6 data to the template
-        qr_codes=qr_codes,
-        urls=urls,
-        images=images,
-        footer_texts=footer_texts,  # Pass column 8 data to the template
+    trace.stage('payload')
+    if shard_size:
+        # Only the names ship with the page; the rest is fetched per shard when a tag is opened
+        shard_files = write_detail_shards(records, shard_size, output_dir)
+        catalogue = build_catalogue_payload(records, columns=['name'])
+        catalogue.update(shards=shard_files, shardSize=shard_size)
+        template_name = 'index_sharded.html'
+    else:
+        shard_files = []
+        catalogue = build_catalogue_payload(records)
+        template_name = 'index.html'
+    # The index outweighs the names in the page, so it is fetched when the search box is first used
+    search_index_file = write_json_asset(build_search_index(rows), 'search', output_dir)
+    trace.stage('vendor')
+    vendor = vendor_runtime_assets(rows, output_dir, session=session, cache=cache, urls=vendor_urls)
+    trace.stage('pdf')
+    pdf_filename = None
+    pdf_cache_dir = os.path.join(cache.cache_dir, 'pdf') if cache is not None else PDF_CACHE_DIR
+    if pdf:
+        # The largest PNG logo variant is a live asset; the original download is swept at the end of the build
+        layout_key = pdf_layout_key()
+        pdf_pages = [
+            dict({field: record[field] for field in ('name', 'deadlines', 'description', 'eligibility', 'url', 'footer', 'qr')},
+                 logo_file=pdf_logo_file(row_assets[key]), key=pdf_page_key(row_assets[key], layout_key))
+            for key, record in zip(keys, records)
+        ]
+        pdf_filename = write_catalogue_pdf(pdf_pages, output_dir, source_dir=asset_dir, cache_dir=pdf_cache_dir, workers=qr_workers, shared=shared, trace=trace)
+    trace.stage('render')
+    bytecode_cache_dir = os.path.join(cache.cache_dir, 'jinja') if cache is not None else TEMPLATE_BYTECODE_DIR
+    rendered_html = get_template_environment(bytecode_cache_dir).get_template(template_name).render(
+        catalogue=catalogue,
+        vendor=vendor,
+        pdf=pdf_filename,
+        search_index=search_index_file,
+        tag_groups=build_tag_groups(rows),
+        cloud_page_size=CLOUD_GROUP_SIZE,
+        logo_formats=LOGO_FORMATS,
+        logo_width=LOGO_WIDTHS[0],
         edition_date=edition_date
     )
-    output_html_path = os.path.join(output_dir, 'index.html')
-    with open(output_html_path, 'w', encoding='utf-8') as htmlfile:
+    trace.stage('write')
+    # Page-level files go to a staging directory first and are moved into place one by one,
+    # index.html last, so a reader never sees a half-written page or a page without its assets
+    staging_dir = os.path.normpath(output_dir) + '.staging'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    with open(os.path.join(staging_dir, 'index.html'), 'w', encoding='utf-8') as htmlfile:
         htmlfile.write(rendered_html)
+    save_build_manifest(staging_dir, {
+        'settings': settings,
+        'order': order,
+        'page': page,
+        'pdf': pdf_filename,
+        'vendor': {'files': vendor['files'], 'complete': vendor['complete']},
+        'rows': {name: row_assets[name] for name in order},
+    })
+    live = live_assets(row_assets[name] for name in order)
+    live.update(shard_files)
+    live.add(search_index_file)
+    live.update(vendor['files'])
+    if pdf_filename:
+        live.add(pdf_filename)
+    trace.stage('compress')
+    for filename in live:
+        write_compressed_variants(os.path.join(output_dir, filename))
+    write_asset_manifest(staging_dir, output_dir, live)
+    write_compressed_variants(os.path.join(staging_dir, 'index.html'), overwrite=True)
+    write_compressed_variants(os.path.join(staging_dir, ASSET_MANIFEST_FILENAME), overwrite=True)
+    trace.stage('publish')
+    publish_staging(staging_dir, output_dir)
+    trace.stage('gc')
+    live.update(('index.html', ASSET_MANIFEST_FILENAME, MANIFEST_FILENAME))
+    candidates = {entry['image'] for entry in previous_rows.values() if entry['image']}
+    candidates.update(entry['image'] for entry in row_assets.values() if entry['image'])
+    collect_garbage(output_dir, live, candidates, quarantine_dir=quarantine_dir)
+    if pdf and not shared:
+        # In a batch the PDF cache is shared by every site and is pruned once all of them are built
+        prune_pdf_cache(pdf_cache_dir, pdf_cache_files((row_assets[name] for name in order), layout_key))
+    trace.finish()
+
+def vendor_file(url, output_dir, prefix, session=None, cache=None):
+    # Copies a third-party file into the output under a content-hashed name; falls back to the original URL when offline
+    extension = os.path.splitext(url.split('?')[0])[1]
+    try:
+        if cache is not None:
+            status_code, entry = cache.fetch_blob(session, url, max_bytes=MAX_VENDOR_BYTES)
+            if entry:
+                source_path, content_hash = cache.blob_path(entry['hash']), entry['hash']
+        else:
+            with (session or requests).get(url, timeout=FETCH_TIMEOUT, stream=True) as response:
+                status_code = response.status_code
+                if status_code == 200:
+                    source_path, content_hash, _ = stream_to_tempfile(response, output_dir, MAX_VENDOR_BYTES)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Не вдалося скачати {url}, лишаю зовнішнє посилання: {str(e)}")
+        return None
+    if status_code not in (200, 304):
+        print(f"Не вдалося скачати {url}, лишаю зовнішнє посилання. Код: {status_code}")
+        return None
+    filename = f"{prefix}_{content_hash[:16]}{extension}"
+    file_path = os.path.join(output_dir, filename)
+    if cache is None:
+        os.replace(source_path, file_path)
+    elif not os.path.exists(file_path):
+        copy_atomic(source_path, file_path)
+    return filename
+
+def vendor_font(rows, output_dir):
+    # Subsets the bundled Noto Sans to the glyphs the page can show: printable ASCII, the sheet and the template text
+    if font_subset is None or not os.path.exists(VENDOR_FONT_PATH):
+        return None, None
+    text = {chr(code) for code in range(0x20, 0x7f)}
+    for row in rows:
+        text.update(''.join(row))
+    for template_name in os.listdir(TEMPLATES_DIR):
+        with open(os.path.join(TEMPLATES_DIR, template_name), 'r', encoding='utf-8') as f:
+            text.update(f.read())
+    text = ''.join(sorted(ch for ch in text if ch.isprintable()))
+    flavor = 'woff2' if brotli else 'woff'
+    key = hashlib.md5((md5(VENDOR_FONT_PATH) + flavor + text).encode()).hexdigest()[:16]
+    filename = f"vendor_font_{key}.{flavor}"
+    font_path = os.path.join(output_dir, filename)
+    if not os.path.exists(font_path):
+        options = font_subset.Options()
+        options.flavor = flavor
+        options.layout_features = ['*']
+        font = font_subset.load_font(VENDOR_FONT_PATH, options)
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(text=text)
+        subsetter.subset(font)
+        font_subset.save_font(font, font_path + '.tmp', options)
+        os.replace(font_path + '.tmp', font_path)
+        print(f"Шрифт зменшено з {os.path.getsize(VENDOR_FONT_PATH) / 1024:.0f} КБ до {os.path.getsize(font_path) / 1024:.0f} КБ ({len(text)} символів).")
+    return filename, flavor
+
+def vendor_runtime_assets(rows, output_dir, session=None, cache=None, urls=None):
+    # urls overrides where the third-party files come from; the benchmark points them at its stand-in server
+    urls = dict({'tagcloud': VENDOR_TAGCLOUD_URL, 'warning_image': VENDOR_WARNING_IMAGE_URL}, **(urls or {}))
+    tagcloud = vendor_file(urls['tagcloud'], output_dir, 'vendor_tagcloud', session=session, cache=cache)
+    warning_image = vendor_file(urls['warning_image'], output_dir, 'vendor_warning', session=session, cache=cache)
+    font, font_format = vendor_font(rows, output_dir)
+    return {
+        'tagcloud': tagcloud or urls['tagcloud'],
+        'warning_image': warning_image or urls['warning_image'],
+        'font': font,
+        'font_format': font_format,
+        # Without fontTools the page keeps loading Montserrat from Google Fonts
+        'font_family': 'Noto Sans, sans-serif' if font else 'Montserrat, sans-serif',
+        'files': [filename for filename in (tagcloud, warning_image, font) if filename],
+        'complete': bool(tagcloud and warning_image),
+    }
+
+def build_catalogue_payload(records, columns=None):
+    # Each column is a list of indices into one shared table of unique strings
+    strings = {}
+    if columns is None:
+        columns = list(records[0]) if records else []
+    payload_columns = {column: [] for column in columns}
+    for record in records:
+        for column in columns:
+            payload_columns[column].append(strings.setdefault(record[column] or '', len(strings)))
+    return {'strings': list(strings), 'columns': payload_columns}
+
+def normalize_search_text(text):
+    # Mirrors normalizeSearch() in templates/base.html: lower case, no diacritics (й -> и, ї -> і, é -> e), words split by single spaces
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.category(ch).startswith('M'))
+    return ' '.join(re.sub(r'[\W_]+', ' ', text).split())
+
+def search_keys(text, field):
+    words = normalize_search_text(text).split()
+    if field == len(SEARCH_COLUMNS) - 1:
+        # Long descriptions are indexed by whole words only to keep the index small; a query word has to match one exactly
+        return {'^' + word for word in words}
+    padded = f" {' '.join(words)} "
+    keys = {padded[i:i + 3] for i in range(len(padded) - 2)}
+    keys.update(' ' + word[0] for word in words)
+    return keys
+
+def build_search_index(rows):
+    # Postings hold row * 4 + field so the page can intersect them without scanning every row.
+    # They are built in ascending order and stored delta-encoded, which keeps the numbers short.
+    postings = {}
+    for row_index, row in enumerate(rows):
+        for field, column in enumerate(SEARCH_COLUMNS):
+            for key in search_keys(row[column], field):
+                postings.setdefault(key, []).append(row_index * 4 + field)
+    return {key: [value - previous for previous, value in zip([0] + values, values)] for key, values in postings.items()}
+
+def build_tag_groups(rows):
+    # Row indices per type (column 1) in sheet order, so the page only animates one group at a time.
+    # A catalogue that fits a single cloud gets no groups and keeps the plain cloud of names.
+    if len(rows) <= CLOUD_GROUP_SIZE:
+        return []
+    groups = {}
+    for row_index, row in enumerate(rows):
+        groups.setdefault(row.type.strip() or CLOUD_FALLBACK_GROUP, []).append(row_index)
+    return [{'name': name, 'rows': indices} for name, indices in groups.items()]
 
-def generate_qr_code(data, output_dir):
+def write_json_asset(data, prefix, output_dir):
+    content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    filename = f"{prefix}_{hashlib.md5(content).hexdigest()[:16]}.json"
+    path = os.path.join(output_dir, filename)
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+    return filename
+
+def write_detail_shards(records, shard_size, output_dir):
+    return [write_json_asset(build_catalogue_payload(records[start:start + shard_size]), 'details', output_dir)
+            for start in range(0, len(records), shard_size)]
+
+def row_keys(rows):
+    # Rows are keyed by the name in column 0; repeated names get a number so they don't overwrite each other
+    seen = {}
+    keys = []
+    for row in rows:
+        seen[row[0]] = seen.get(row[0], 0) + 1
+        keys.append(row[0] if seen[row[0]] == 1 else f"{row[0]} #{seen[row[0]]}")
+    return keys
+
+def row_hash(row):
+    return hashlib.md5(json.dumps(row, ensure_ascii=False).encode()).hexdigest()
+
+def build_settings_key(qr_format):
+    # Changing any of these invalidates every stored row asset
+    settings = [QR_STYLE, qr_format, LOGO_WIDTHS, LOGO_FORMATS, LOGO_PLACEHOLDER_SIZE]
+    return hashlib.md5(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+def build_page_key():
+    # What index.html and the page-level files are made of besides the rows: templates, vendored files and layout settings
+    sources = [
+        [name, md5(os.path.join(TEMPLATES_DIR, name))] for name in sorted(os.listdir(TEMPLATES_DIR))
+    ]
+    sources.append(md5(VENDOR_FONT_PATH) if os.path.exists(VENDOR_FONT_PATH) else None)
+    sources += [VENDOR_TAGCLOUD_URL, VENDOR_WARNING_IMAGE_URL, font_subset is not None, brotli is not None, CLOUD_GROUP_SIZE]
+    sources += [PDF_PAGE_SIZE, PDF_MARGIN, PDF_LOGO_BOX, PDF_QR_SIZE, PDF_FONT_SIZES, PDF_LINE_HEIGHT, PDF_JPEG_QUALITY]
+    return hashlib.md5(json.dumps(sources, sort_keys=True).encode()).hexdigest()
+
+def load_build_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        print(f"Файл {MANIFEST_FILENAME} пошкоджено, сайт буде згенеровано повністю.")
+        return {}
+
+def save_build_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def row_assets_exist(entry, output_dir):
+    if not entry['image']:
+        return False  # the image failed to download last time, try again
+    return all(os.path.exists(os.path.join(output_dir, filename)) for filename in live_assets([entry]))
+
+def live_assets(entries):
+    # Files the page references: logo variants (or the original if optimisation failed) and QR codes
+    live = set()
+    for entry in entries:
+        if entry['logo']:
+            live.add(entry['logo']['src'])
+            for srcset in entry['logo']['srcset'].values():
+                live.update(candidate.split(' ')[0] for candidate in srcset.split(', '))
+        elif entry['image']:
+            live.add(entry['image'])
+        if not entry['qr'].startswith('data:'):
+            live.add(entry['qr'])
+    return live
+
+def collect_garbage(output_dir, live, candidates=(), quarantine_dir=None):
+    orphans = []
+    for filename in os.listdir(output_dir):
+        base_name = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+        if base_name in live or not os.path.isfile(os.path.join(output_dir, filename)):
+            continue
+        if base_name in candidates or any(fnmatch.fnmatch(filename, pattern) for pattern in GC_PATTERNS):
+            orphans.append(filename)
+    if not orphans:
+        return 0
+    if quarantine_dir:
+        os.makedirs(quarantine_dir, exist_ok=True)
+    reclaimed = 0
+    for filename in orphans:
+        path = os.path.join(output_dir, filename)
+        reclaimed += os.path.getsize(path)
+        if quarantine_dir:
+            os.replace(path, os.path.join(quarantine_dir, filename))
+        else:
+            os.remove(path)
+    action = f"переміщено в {quarantine_dir}" if quarantine_dir else "видалено"
+    print(f"Невикористаних файлів {action}: {len(orphans)}, звільнено {reclaimed / 1024:.0f} КБ.")
+    return reclaimed
+
+def write_compressed_variants(path, overwrite=False):
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return
+    with open(path, 'rb') as f:
+        content = None
+        for extension, compress in (('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+                                    ('.br', brotli.compress if brotli else None)):
+            if compress is None or (not overwrite and os.path.exists(path + extension)):
+                continue
+            if content is None:
+                content = f.read()
+            compressed = compress(content)
+            if len(compressed) >= len(content):
+                continue
+            with open(path + extension + '.tmp', 'wb') as out:
+                out.write(compressed)
+            os.replace(path + extension + '.tmp', path + extension)
+
+def write_asset_manifest(staging_dir, output_dir, live):
+    # Content-hashed assets can be cached forever; only index.html has to be revalidated
+    assets = {'index.html': {'size': os.path.getsize(os.path.join(staging_dir, 'index.html')), 'immutable': False}}
+    for filename in sorted(live):
+        assets[filename] = {
+            'size': os.path.getsize(os.path.join(output_dir, filename)),
+            'immutable': any(fnmatch.fnmatch(filename, pattern) for pattern in HASHED_ASSET_PATTERNS),
+        }
+    with open(os.path.join(staging_dir, ASSET_MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(assets, f, ensure_ascii=False, indent=1)
+
+def publish_staging(staging_dir, output_dir):
+    filenames = sorted(os.listdir(staging_dir), key=lambda filename: filename.startswith('index.html'))
+    for filename in filenames:
+        os.replace(os.path.join(staging_dir, filename), os.path.join(output_dir, filename))
+    os.rmdir(staging_dir)
+
+def diff_build_manifest(previous_rows, row_hashes):
+    added = [name for name in row_hashes if name not in previous_rows]
+    changed = [name for name, value in row_hashes.items() if name in previous_rows and previous_rows[name]['hash'] != value]
+    removed = [name for name in previous_rows if name not in row_hashes]
+    return added, changed, removed
+
+class CompactSvgQrImage(qrcode.image.svg.SvgPathImage):
+    """Single-path SVG QR where each run of dark modules in a row is one module-thick line."""
+
+    needs_drawrect = False
+
+    def new_image(self, fill_color='black', back_color=None, **kwargs):
+        self.fill_color = fill_color
+        self.background = back_color
+        return super().new_image(**kwargs)
+
+    def _svg(self, viewBox=None, **kwargs):
+        size = self.width + self.border * 2
+        return super()._svg(viewBox=f"0 0 {size} {size}", **kwargs)
+
+    def process(self):
+        subpaths = []
+        for y, row in enumerate(self.modules):
+            x = 0
+            end = None
+            while x < self.width:
+                if not row[x]:
+                    x += 1
+                    continue
+                start = x
+                while x < self.width and row[x]:
+                    x += 1
+                if end is None:
+                    subpaths.append(f"M{start + self.border} {y + self.border + 0.5:g}h{x - start}")
+                else:
+                    subpaths.append(f"m{start - end} 0h{x - start}")
+                end = x
+        self.path = ET.Element('path', d=''.join(subpaths), stroke=self.fill_color)
+        self._img.set('shape-rendering', 'crispEdges')
+        self._img.append(self.path)
+
+def qr_code_filename(data, style=QR_STYLE, fmt=QR_FORMAT):
+    # Render parameters are part of the key, so a style change produces new files instead of stale ones
+    key = json.dumps([data, style], sort_keys=True, ensure_ascii=False)
+    extension = 'png' if fmt == 'png' else 'svg'
+    return f"qr_{hashlib.md5(key.encode()).hexdigest()}.{extension}"
+
+def make_qr_code(data, style=QR_STYLE):
     qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=0,
+        version=style['version'],
+        error_correction=QR_ERROR_CORRECTION[style['error_correction']],
+        box_size=style['box_size'],
+        border=style['border'],
     )
     qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="lightgrey")
-    qr_code_filename = f"qr_{hashlib.md5(data.encode()).hexdigest()}.png"
-    qr_code_path = os.path.join(output_dir, qr_code_filename)
-    img.save(qr_code_path)
-    return qr_code_filename
+    return qr
+
+def generate_qr_code(data, output_dir, style=QR_STYLE, fmt=QR_FORMAT):
+    filename = qr_code_filename(data, style, fmt)
+    qr_code_path = os.path.join(output_dir, filename)
+    if fmt != 'inline' and os.path.exists(qr_code_path):
+        return filename
+    qr = make_qr_code(data, style)
+    if fmt == 'png':
+        img = qr.make_image(fill_color=style['fill_color'], back_color=style['back_color'])
+    else:
+        img = qr.make_image(image_factory=CompactSvgQrImage, fill_color=style['fill_color'], back_color=style['back_color'])
+    if fmt == 'inline':
+        return 'data:image/svg+xml;base64,' + base64.b64encode(img.to_string()).decode('ascii')
+    tmp_path = qr_code_path + '.tmp'
+    img.save(tmp_path)
+    os.replace(tmp_path, qr_code_path)
+    return filename
+
+def render_qr_codes(datas, output_dir, style=QR_STYLE, workers=QR_WORKERS, min_pool_batch=QR_POOL_MIN_BATCH, fmt=QR_FORMAT, shared=None, trace=None, names=None):
+    unique_datas = list(dict.fromkeys(datas))
+    trace = trace or BuildTrace()
+    names = names or {}
+    results = {}
+    pending = []
+    for data in unique_datas:
+        filename = qr_code_filename(data, style, fmt)
+        if fmt != 'inline' and os.path.exists(os.path.join(output_dir, filename)):
+            results[data] = filename
+        else:
+            pending.append(data)
+    render = partial(generate_qr_code, output_dir=output_dir, style=style, fmt=fmt)
+    if shared and pending:
+        futures = [shared.submit(('qr', output_dir, qr_code_filename(data, style, fmt)), partial(shared.processes.submit, render, data))
+                   for data in pending]
+        results.update(zip(pending, (future.result() for future in futures)))
+    elif workers > 1 and len(pending) >= min_pool_batch:
+        print(f"Генеруються QR-коди ({len(pending)} шт., процесів - {workers})...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            timed = executor.map(partial(timed_call, render), pending, chunksize=max(1, len(pending) // (workers * 4)))
+            for data, (filename, start, duration, worker) in zip(pending, timed):
+                trace.add('qr', 'item', start, duration, tid=worker, row=names.get(data), url=data)
+                results[data] = filename
+    else:
+        for data in pending:
+            with trace.item('qr', row=names.get(data), url=data):
+                results[data] = render(data)
+    return results
+
+def logo_placeholder(image):
+    """Dominant colour and a tiny WebP preview (a data URI of a few hundred bytes) of a decoded logo."""
+    rgba = image.convert('RGBA')
+    # Resizing RGBA premultiplies alpha, so transparent margins do not darken the average colour
+    red, green, blue, _ = rgba.resize((1, 1), Image.BOX).getpixel((0, 0))
+    thumbnail = rgba.copy()
+    thumbnail.thumbnail((LOGO_PLACEHOLDER_SIZE, LOGO_PLACEHOLDER_SIZE), Image.BOX)
+    out = io.BytesIO()
+    thumbnail.save(out, format='WEBP', quality=40)
+    return f"#{red:02x}{green:02x}{blue:02x}", 'data:image/webp;base64,' + base64.b64encode(out.getvalue()).decode('ascii')
+
+def load_image_meta(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def save_image_meta(path, image_meta):
+    if not path:
+        return
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(image_meta, f)
+    os.replace(tmp_path, path)
+
+def optimize_logo(filename, output_dir, widths=LOGO_WIDTHS, formats=LOGO_FORMATS, image_meta=None):
+    source_path = os.path.join(output_dir, filename)
+    # Variant names carry the source content hash, so unchanged logos are not reprocessed
+    content_hash = md5(source_path)
+    source_hash = content_hash[:16]
+    # Size and placeholder are cached by content hash too, so a known logo is never decoded again
+    meta = image_meta.get(content_hash) if image_meta is not None else None
+    try:
+        with Image.open(source_path) as source:
+            target_widths = sorted(set(min(width, source.width) for width in widths))
+            variants = {
+                (fmt, width): f"logo_{source_hash}_{width}.{fmt}"
+                for fmt in formats for width in target_widths
+            }
+            missing = [key for key, name in variants.items() if not os.path.exists(os.path.join(output_dir, name))]
+            if missing or meta is None:
+                source.load()
+                image = source.convert('RGBA' if source.mode in ('P', 'LA', 'RGBA', 'PA') else 'RGB')
+            if meta is None:
+                color, placeholder = logo_placeholder(image)
+                meta = {'width': source.width, 'height': source.height, 'color': color, 'placeholder': placeholder}
+                if image_meta is not None:
+                    image_meta[content_hash] = meta
+            if missing:
+                resized = {}
+                for fmt, width in missing:
+                    if width not in resized:
+                        height = max(1, round(image.height * width / image.width))
+                        resized[width] = image.resize((width, height), Image.LANCZOS) if width != image.width else image.copy()
+                        resized[width].info = {}  # drop EXIF, ICC and text metadata
+                    variant_path = os.path.join(output_dir, variants[(fmt, width)])
+                    tmp_path = variant_path + '.tmp'
+                    resized[width].save(tmp_path, format=fmt.upper(), **LOGO_SAVE_OPTIONS[fmt])
+                    os.replace(tmp_path, variant_path)
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Картинку {filename} не оптимізовано: {str(e)}")
+        return None
+    srcset = {
+        fmt: ', '.join(f"{variants[(fmt, width)]} {width}w" for width in target_widths)
+        for fmt in formats
+    }
+    sizes = {fmt: os.path.getsize(os.path.join(output_dir, variants[(fmt, target_widths[0])])) for fmt in formats}
+    return {
+        'src': variants[('png', target_widths[0])],
+        'srcset': srcset,
+        'before': os.path.getsize(source_path),
+        'after': sizes,
+        # Size of the 1x variant, so the page can reserve the box before the file arrives
+        'width': target_widths[0],
+        'height': max(1, round(meta['height'] * target_widths[0] / meta['width'])),
+        'color': meta['color'],
+        'placeholder': meta['placeholder'],
+    }
+
+def optimize_logos(filenames, output_dir, workers=QR_WORKERS, trace=None, shared=None, image_meta=None):
+    unique_filenames = [filename for filename in dict.fromkeys(filenames) if filename]
+    trace = trace or BuildTrace()
+    def optimize(filename):
+        def work():
+            with trace.item('logo', file=filename):
+                return optimize_logo(filename, output_dir, image_meta=image_meta)
+        return shared.run(('logo', output_dir, filename), work) if shared else work()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        logos = dict(zip(unique_filenames, executor.map(optimize, unique_filenames)))
+    logos = {filename: logo for filename, logo in logos.items() if logo}
+    if logos:
+        print("Оптимізація логотипів (байти: оригінал -> найменший варіант для 1x):")
+        total_before = total_after = 0
+        for filename, logo in logos.items():
+            best = min(logo['after'].values())
+            total_before += logo['before']
+            total_after += best
+            details = ', '.join(f"{fmt} {size}" for fmt, size in logo['after'].items())
+            print(f"{logo['before']:>10} -> {best:>8}  {filename} ({details})")
+        print(f"{total_before:>10} -> {total_after:>8}  разом\n")
+    return logos
+
+@lru_cache(maxsize=None)
+def pdf_font():
+    # Glyph ids and advance widths of the bundled font, in font units; the PDF embeds a subset with the same ids
+    font = TTFont(VENDOR_FONT_PATH, lazy=True)
+    glyph_ids = font.getReverseGlyphMap()
+    return {
+        'cmap': {code: glyph_ids[name] for code, name in font.getBestCmap().items()},
+        'advances': {glyph_ids[name]: advance for name, (advance, _) in font['hmtx'].metrics.items()},
+        'units_per_em': font['head'].unitsPerEm,
+        'bbox': [font['head'].xMin, font['head'].yMin, font['head'].xMax, font['head'].yMax],
+        'ascent': font['hhea'].ascent,
+        'descent': font['hhea'].descent,
+    }
+
+def pdf_text(text):
+    # The page shows cells as HTML, the PDF gets plain text without glyphs the font lacks (emoji would print as boxes)
+    text = html.unescape(re.sub(r'<[^>]+>', '', re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)))
+    cmap = pdf_font()['cmap']
+    text = ''.join(ch for ch in text if ch in '\n' or ord(ch) in cmap)
+    return '\n'.join(' '.join(line.split()) for line in text.split('\n')).strip()
+
+def pdf_text_width(text, size):
+    font = pdf_font()
+    return sum(font['advances'][font['cmap'][ord(ch)]] for ch in text) * size / font['units_per_em']
+
+def wrap_text(text, size, width):
+    lines = []
+    space = pdf_text_width(' ', size)
+    for paragraph in text.split('\n'):
+        line, line_width = '', 0
+        for word in paragraph.split(' '):
+            word_width = pdf_text_width(word, size)
+            if (line_width + space if line else 0) + word_width <= width:
+                line, line_width = f"{line} {word}" if line else word, (line_width + space if line else 0) + word_width
+                continue
+            if line:
+                lines.append(line)
+            while word_width > width:
+                # A single word wider than the page (usually a URL) is broken by characters
+                cut = len(word) - 1
+                while cut > 1 and pdf_text_width(word[:cut], size) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+                word_width = pdf_text_width(word, size)
+            line, line_width = word, word_width
+        lines.append(line)
+    return lines
+
+def pdf_logo_file(assets):
+    if assets['logo']:
+        return assets['logo']['srcset']['png'].split(', ')[-1].split(' ')[0]
+    return assets['image']  # kept as a live asset when it could not be optimised
+
+def layout_pdf_pages(page):
+    # One catalogue row: logo and QR on top, then the text blocks, continued on further pages if it runs long.
+    # Every page is a list of drawing operations in points from the top left corner.
+    width, height = PDF_PAGE_SIZE
+    text_width = width - 2 * PDF_MARGIN
+    qr_box = (width - PDF_MARGIN - PDF_QR_SIZE, PDF_MARGIN, PDF_QR_SIZE, PDF_QR_SIZE)
+    operations = [('qr', page['qr'], page['url'], *qr_box), ('link', page['url'], *qr_box)]
+    if page['logo_file']:
+        operations.append(('image', page['logo_file'], PDF_MARGIN, PDF_MARGIN, *PDF_LOGO_BOX))
+    blocks = [
+        ('name', page['name'], 'black', None),
+        ('deadlines', page['deadlines'], '#c00000', None),
+        ('text', page['description'], 'black', None),
+        ('text', page['eligibility'], 'black', None),
+        ('footer', page['url'], '#1a4fa0', page['url']),
+        ('footer', page['footer'], '#555555', None),
+    ]
+    pages = [operations]
+    y = PDF_MARGIN + max(PDF_LOGO_BOX[1], PDF_QR_SIZE) + 24
+    for style, text, color, link in blocks:
+        size = PDF_FONT_SIZES[style]
+        line_height = size * PDF_LINE_HEIGHT
+        for line in wrap_text(pdf_text(text), size, text_width) if text else []:
+            if y + line_height > height - PDF_MARGIN:
+                operations = []
+                pages.append(operations)
+                y = PDF_MARGIN
+            operations.append(('text', line, PDF_MARGIN, y, size, color))
+            if link:
+                operations.append(('link', link, PDF_MARGIN, y, pdf_text_width(line, size), line_height))
+            y += line_height
+        if text:
+            y += line_height / 2
+    return pages
+
+def pdf_layout_key():
+    # Everything besides the row that shapes its pages: layout constants, QR style and the font
+    settings = [PDF_PAGE_SIZE, PDF_MARGIN, PDF_LOGO_BOX, PDF_QR_SIZE, PDF_FONT_SIZES, PDF_LINE_HEIGHT, QR_STYLE]
+    return hashlib.md5(json.dumps([settings, md5(VENDOR_FONT_PATH) if os.path.exists(VENDOR_FONT_PATH) else None]).encode()).hexdigest()
+
+def pdf_page_key(entry, layout_key):
+    # The row hash covers every cell, and the logo and QR files are named after their content
+    return hashlib.md5(json.dumps([layout_key, entry['hash'], pdf_logo_file(entry), entry['qr']]).encode()).hexdigest()
+
+def pdf_image_name(filename):
+    return 'Im' + hashlib.md5(filename.encode()).hexdigest()[:16]
+
+def pdf_xobject_filename(filename):
+    return f"xobject_{hashlib.md5(json.dumps([filename, PDF_JPEG_QUALITY]).encode()).hexdigest()}.bin"
+
+def pdf_cache_files(entries, layout_key):
+    # Files in the PDF cache that the pages of these manifest rows are built from; the rest is stale
+    live = set()
+    for entry in entries:
+        live.add(f"page_{pdf_page_key(entry, layout_key)}.json")
+        if pdf_logo_file(entry):
+            live.add(pdf_xobject_filename(pdf_logo_file(entry)))
+    return live
+
+def prune_pdf_cache(cache_dir, live):
+    if not os.path.isdir(cache_dir):
+        return
+    for filename in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, filename)
+        if filename not in live and os.path.isfile(path):
+            os.remove(path)
+
+def pdf_qr_matrix(filename, data, source_dir):
+    # Reading the modules back from the rendered PNG is much cheaper than encoding the QR code again
+    if filename.endswith('.png'):
+        box_size = QR_STYLE['box_size']
+        try:
+            with Image.open(os.path.join(source_dir, filename)) as source:
+                image = source.convert('L')
+        except (UnidentifiedImageError, OSError):
+            pass
+        else:
+            threshold = (ImageColor.getcolor(QR_STYLE['fill_color'], 'L') + ImageColor.getcolor(QR_STYLE['back_color'], 'L')) / 2
+            pixels = image.load()
+            modules = range(image.width // box_size)
+            return [[pixels[x * box_size + box_size // 2, y * box_size + box_size // 2] < threshold for x in modules] for y in modules]
+    return make_qr_code(data).get_matrix()
+
+def render_pdf_row(page, source_dir, cache_dir):
+    """Lays out one catalogue row as compressed content streams and caches them under the row's page key."""
+    width, height = PDF_PAGE_SIZE
+    font = pdf_font()
+    rendered = {'pages': [], 'glyphs': {}}
+    complete = True
+    for operations in layout_pdf_pages(page):
+        content, images, links = [], [], []
+        for operation in operations:
+            kind = operation[0]
+            if kind == 'text':
+                _, text, x, y, size, color = operation
+                glyph_ids = [font['cmap'][ord(ch)] for ch in text]
+                rendered['glyphs'].update(zip(map(str, glyph_ids), text))
+                baseline = height - y - font['ascent'] * size / font['units_per_em']
+                content.append(f"BT /F1 {size:g} Tf {pdf_color(color)} rg {x:.2f} {baseline:.2f} Td <{''.join(f'{glyph:04x}' for glyph in glyph_ids)}> Tj ET")
+            elif kind == 'image':
+                _, filename, x, y, box_width, box_height = operation
+                try:
+                    with Image.open(os.path.join(source_dir, filename)) as source:
+                        image_width, image_height = source.size
+                except (UnidentifiedImageError, OSError) as e:
+                    # Such a page is not cached, so the logo is tried again on the next build
+                    print(f"Картинку {filename} не додано в PDF: {str(e)}")
+                    complete = False
+                    continue
+                scale = min(box_width / image_width, box_height / image_height)
+                draw_width, draw_height = image_width * scale, image_height * scale
+                images.append(filename)
+                content.append(f"q {draw_width:.2f} 0 0 {draw_height:.2f} {x:.2f} {height - y - (box_height + draw_height) / 2:.2f} cm /{pdf_image_name(filename)} Do Q")
+            elif kind == 'qr':
+                # Each run of dark modules in a row is one rectangle, as in CompactSvgQrImage
+                _, qr_file, data, x, y, size, _ = operation
+                matrix = pdf_qr_matrix(qr_file, data, source_dir)
+                module = size / len(matrix)
+                content.append(f"{pdf_color(QR_STYLE['back_color'])} rg {x:.2f} {height - y - size:.2f} {size:.2f} {size:.2f} re f")
+                content.append(f"{pdf_color(QR_STYLE['fill_color'])} rg")
+                for row_index, row in enumerate(matrix):
+                    column = 0
+                    while column < len(row):
+                        if not row[column]:
+                            column += 1
+                            continue
+                        start = column
+                        while column < len(row) and row[column]:
+                            column += 1
+                        content.append(f"{x + start * module:.2f} {height - y - (row_index + 1) * module:.2f} {(column - start) * module:.2f} {module:.2f} re")
+                content.append('f')
+            elif kind == 'link':
+                _, url, x, y, link_width, link_height = operation
+                links.append([url, x, height - y - link_height, x + link_width, height - y])
+        rendered['pages'].append({
+            'content': base64.b64encode(zlib.compress('\n'.join(content).encode('ascii'))).decode('ascii'),
+            'images': images,
+            'links': links,
+        })
+    if complete:
+        cache_path = os.path.join(cache_dir, f"page_{page['key']}.json")
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(rendered, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    return rendered
+
+def cached_pdf_row(key, cache_dir):
+    try:
+        with open(os.path.join(cache_dir, f"page_{key}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def pdf_color(color):
+    return ' '.join(f"{channel / 255:.3g}" for channel in ImageColor.getrgb(color)[:3])
+
+def pdf_string(text):
+    # Text strings outside content streams (the document title) are UTF-16 with a byte order mark
+    return b'<feff' + text.encode('utf-16-be').hex().encode() + b'>'
+
+class PdfDocument:
+    """Minimal PDF writer: pages from render_pdf_row, one embedded font subset, shared images and links."""
+
+    def __init__(self, source_dir, cache_dir):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.objects = [None, None, None]  # catalog, page tree and font, filled in by save()
+        self.pages = []
+        self.images = {}
+        self.glyphs = {}
+
+    def add(self, content):
+        self.objects.append(content)
+        return len(self.objects)
+
+    def stream(self, dictionary, data):
+        data = zlib.compress(data)
+        return b'<< ' + dictionary + b' /Filter /FlateDecode /Length %d >>\nstream\n' % len(data) + data + b'\nendstream'
+
+    def encode_image(self, filename):
+        with Image.open(os.path.join(self.source_dir, filename)) as source:
+            image = source.convert('RGBA')
+        # Logos sit on the white page, so transparency is flattened instead of carried as a soft mask.
+        # Flat artwork compresses best losslessly, photos as JPEG; whichever is smaller is embedded.
+        flat = Image.new('RGB', image.size, 'white')
+        flat.paste(image, mask=image.getchannel('A'))
+        dictionary = b'/Type /XObject /Subtype /Image /Width %d /Height %d /BitsPerComponent 8 /ColorSpace /DeviceRGB' % image.size
+        encoded = self.stream(dictionary, flat.tobytes())
+        jpeg = io.BytesIO()
+        flat.save(jpeg, format='JPEG', quality=PDF_JPEG_QUALITY)
+        if len(jpeg.getvalue()) < len(encoded):
+            encoded = b'<< ' + dictionary + b' /Filter /DCTDecode /Length %d >>\nstream\n' % len(jpeg.getvalue()) + jpeg.getvalue() + b'\nendstream'
+        return encoded
+
+    def image(self, filename):
+        if filename in self.images:
+            return self.images[filename]
+        # Logo files are named after their content, so an encoded image is reused by every later build
+        cache_path = os.path.join(self.cache_dir, pdf_xobject_filename(filename))
+        try:
+            with open(cache_path, 'rb') as f:
+                encoded = f.read()
+        except OSError:
+            try:
+                encoded = self.encode_image(filename)
+            except (UnidentifiedImageError, OSError) as e:
+                print(f"Картинку {filename} не додано в PDF: {str(e)}")
+                # A blank pixel keeps the page's reference valid; nothing is cached, so the next build retries
+                encoded = self.stream(b'/Type /XObject /Subtype /Image /Width 1 /Height 1 /BitsPerComponent 8 /ColorSpace /DeviceRGB', b'\xff\xff\xff')
+            else:
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(encoded)
+                os.replace(tmp_path, cache_path)
+        self.images[filename] = self.add(encoded)
+        return self.images[filename]
+
+    def add_page(self, page):
+        width, height = PDF_PAGE_SIZE
+        content = base64.b64decode(page['content'])
+        contents = self.add(b'<< /Filter /FlateDecode /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+        xobjects = ''.join(f"/{pdf_image_name(filename)} {self.image(filename)} 0 R " for filename in dict.fromkeys(page['images']))
+        annotations = []
+        for url, left, bottom, right, top in page['links']:
+            uri = re.sub(rb'([\\()])', rb'\\\1', quote(url, safe=":/?#[]@!$&'()*+,;=%~").encode('ascii'))
+            annotations.append(self.add(b'<< /Type /Annot /Subtype /Link /Rect [%.2f %.2f %.2f %.2f] /Border [0 0 0] /A << /S /URI /URI (%s) >> >>'
+                                        % (left, bottom, right, top, uri)))
+        self.pages.append(self.add((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:g} {height:g}] /Contents {contents} 0 R"
+            f" /Resources << /Font << /F1 3 0 R >> /XObject << {xobjects}>> >>"
+            f" /Annots [{' '.join(f'{number} 0 R' for number in annotations)}] >>"
+        ).encode('ascii')))
+
+    def embed_font(self):
+        # The subset keeps the original glyph ids, so the content streams can address glyphs by id (Identity-H)
+        font = pdf_font()
+        options = font_subset.Options()
+        options.retain_gids = True
+        options.hinting = False
+        options.layout_features = []
+        subset = font_subset.load_font(VENDOR_FONT_PATH, options)
+        subset.recalcTimestamp = False  # the same glyphs give the same bytes, and so the same PDF name
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(gids=sorted(self.glyphs))
+        subsetter.subset(subset)
+        out = io.BytesIO()
+        font_subset.save_font(subset, out, options)
+        scale = 1000 / font['units_per_em']
+        tag = ''.join(chr(ord('A') + int(ch, 16) % 26) for ch in hashlib.md5(repr(sorted(self.glyphs)).encode()).hexdigest()[:6])
+        name = f"/{tag}+NotoSans"
+        font_file = self.add(self.stream(b'/Length1 %d' % len(out.getvalue()), out.getvalue()))
+        descriptor = self.add((
+            f"<< /Type /FontDescriptor /FontName {name} /Flags 32 /FontBBox [{' '.join(str(round(value * scale)) for value in font['bbox'])}]"
+            f" /ItalicAngle 0 /Ascent {round(font['ascent'] * scale)} /Descent {round(font['descent'] * scale)}"
+            f" /CapHeight {round(font['ascent'] * scale)} /StemV 80 /FontFile2 {font_file} 0 R >>"
+        ).encode('ascii'))
+        widths = ' '.join(f"{glyph} [{round(font['advances'][glyph] * scale)}]" for glyph in sorted(self.glyphs))
+        cid_font = self.add((
+            f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont {name} /CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >>"
+            f" /FontDescriptor {descriptor} 0 R /W [{widths}] /CIDToGIDMap /Identity >>"
+        ).encode('ascii'))
+        # ToUnicode makes the text selectable and searchable
+        mappings = [f"<{glyph:04x}> <{ch.encode('utf-16-be').hex()}>" for glyph, ch in sorted(self.glyphs.items())]
+        blocks = ''.join(f"{len(mappings[start:start + 100])} beginbfchar\n" + '\n'.join(mappings[start:start + 100]) + "\nendbfchar\n"
+                         for start in range(0, len(mappings), 100))
+        to_unicode = self.add(self.stream(b'', (
+            "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+            "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n1 begincodespacerange\n<0000> <ffff>\nendcodespacerange\n"
+            f"{blocks}endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend"
+        ).encode('ascii')))
+        self.objects[2] = (
+            f"<< /Type /Font /Subtype /Type0 /BaseFont {name} /Encoding /Identity-H"
+            f" /DescendantFonts [{cid_font} 0 R] /ToUnicode {to_unicode} 0 R >>"
+        ).encode('ascii')
+
+    def save(self, title):
+        self.embed_font()
+        self.objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+        self.objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % page for page in self.pages), len(self.pages))
+        info = self.add(b'<< /Title ' + pdf_string(title) + b' >>')
+        out = io.BytesIO()
+        out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, content in enumerate(self.objects, 1):
+            offsets.append(out.tell())
+            out.write(b'%d 0 obj\n' % number + content + b'\nendobj\n')
+        xref = out.tell()
+        out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.objects) + 1))
+        out.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+        out.write(b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(self.objects) + 1, info, xref))
+        return out.getvalue()
+
+def write_catalogue_pdf(pages, output_dir, source_dir=None, cache_dir=PDF_CACHE_DIR, workers=QR_WORKERS, min_pool_batch=QR_POOL_MIN_BATCH, shared=None, trace=None):
+    trace = trace or BuildTrace()
+    if not pages or not os.path.exists(VENDOR_FONT_PATH) or font_subset is None:
+        print("PDF не створено: немає шрифту NotoSans.ttf або бібліотеки fontTools.")
+        return None
+    # Logos and QR codes are read from source_dir, the shared asset store in a batch
+    source_dir = source_dir or output_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    # Only rows without a cached layout are laid out again, in the same process pool as QR codes
+    rendered = [cached_pdf_row(page['key'], cache_dir) for page in pages]
+    pending = [index for index, row in enumerate(rendered) if row is None]
+    render = partial(render_pdf_row, source_dir=source_dir, cache_dir=cache_dir)
+    if pending:
+        print(f"Верстаються сторінки PDF ({len(pending)} з {len(pages)})...")
+    if shared and pending:
+        futures = [shared.submit(('pdf', cache_dir, pages[index]['key']), partial(shared.processes.submit, render, pages[index])) for index in pending]
+        for index, future in zip(pending, futures):
+            rendered[index] = future.result()
+    elif workers > 1 and len(pending) >= min_pool_batch:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            timed = executor.map(partial(timed_call, render), [pages[index] for index in pending], chunksize=max(1, len(pending) // (workers * 4)))
+            for index, (row, start, duration, worker) in zip(pending, timed):
+                trace.add('pdf', 'item', start, duration, tid=worker, row=pages[index]['name'])
+                rendered[index] = row
+    else:
+        for index in pending:
+            with trace.item('pdf', row=pages[index]['name']):
+                rendered[index] = render(pages[index])
+    document = PdfDocument(source_dir, cache_dir)
+    for row in rendered:
+        document.glyphs.update((int(glyph), ch) for glyph, ch in row['glyphs'].items())
+        for page in row['pages']:
+            document.add_page(page)
+    content = document.save('Каталог можливостей')
+    # Named after the content like the other assets; a logo that failed to load changes the bytes, so the next build retries it
+    filename = f"catalogue_{hashlib.md5(content).hexdigest()[:16]}.pdf"
+    pdf_path = os.path.join(output_dir, filename)
+    if not os.path.exists(pdf_path):
+        with open(pdf_path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(pdf_path + '.tmp', pdf_path)
+    print(f"PDF: {len(document.pages)} стор., {len(content) / 1024:.0f} КБ.")
+    return filename
 
 def md5(file_path):
     hash_md5 = hashlib.md5()
@@ -679,14 +1596,605 @@ def md5(file_path):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-if __name__ == "__main__":
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    files_dir = os.path.join(base_dir, 'files')
-    os.makedirs(files_dir, exist_ok=True)
-    spreadsheet_id = '1KUm0d2ieWXLM9iwAGIiIOs2ePDCnApBe88GuRbf3Qr8'  
+def synthetic_sheet(rows_count, logo_base_url, source_csv, logo_count=BENCH_LOGO_COUNT):
+    # Cycles the rows of a real sheet, making names and links unique so every row gets its own QR code
+    with open(source_csv, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        headers = next(reader)
+        samples = [row for row in reader if any(row)]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(headers)
+    for index in range(rows_count):
+        row = list(samples[index % len(samples)])
+        row[0] = f"{row[0]} {index}"
+        row[2] = f"{logo_base_url}bench_logo_{index % logo_count}.png"
+        row[7] = f"https://example.com/opportunity/{index}"
+        writer.writerow(row)
+    return out.getvalue().encode('utf-8')
+
+def synthetic_logo(index, size=BENCH_LOGO_SIZE):
+    # Flat coloured shapes on a transparent background, which encode like the real logos in the sheet
+    rng = random.Random(index)
+    image = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size), rng.randrange(size)
+        radius = rng.randrange(size // 16, size // 3)
+        colour = (rng.randrange(256), rng.randrange(256), rng.randrange(256), 255)
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape((x - radius, y - radius, x + radius, y + radius), fill=colour)
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+def synthetic_vendor_files():
+    # Roughly the size of TagCloud.min.js and the warning photo, so the vendor stage copies comparable bytes
+    script = b'/* benchmark stand-in for TagCloud.min.js */\n' + b'var TagCloud=function(){};\n' * 256
+    image = Image.open(io.BytesIO(synthetic_logo(-1, 960))).convert('RGB')
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=85)
+    return {
+        BENCH_VENDOR_URLS['tagcloud']: ('application/javascript', script),
+        BENCH_VENDOR_URLS['warning_image']: ('image/jpeg', out.getvalue()),
+    }
+
+def start_bench_server(source_csv, latency=BENCH_LATENCY, logo_size=BENCH_LOGO_SIZE, logo_count=BENCH_LOGO_COUNT):
+    """Local stand-in for Google Sheets, i.ibb.co and the CDNs: /sheet/<rows>.csv, /logo/bench_logo_<n>.png and /vendor/*."""
+    # Logos are rendered up front, so the server's own work does not show up as download time
+    bodies = {f"/logo/bench_logo_{index}.png": ('image/png', synthetic_logo(index, logo_size)) for index in range(logo_count)}
+    bodies.update(synthetic_vendor_files())
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            with lock:
+                if self.path not in bodies:
+                    sheet = re.fullmatch(r'/sheet/(\d+)\.csv', self.path)
+                    if sheet:
+                        bodies[self.path] = ('text/csv', synthetic_sheet(int(sheet.group(1)), f"http://127.0.0.1:{server.server_port}/logo/", source_csv, logo_count))
+                body = bodies.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            content_type, content = body
+            etag = '"' + hashlib.md5(content).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS; children cover the QR and logo process pools
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / scale, 1)
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def run_benchmark_case(rows_count, sheet_url, vendor_urls, work_dir, build_options):
+    # Runs in a fresh process, so peak RSS belongs to this sheet size alone
+    output_dir = os.path.join(work_dir, f"out_{rows_count}")
+    os.makedirs(output_dir)
+    cache = HttpCache(os.path.join(work_dir, f"cache_{rows_count}"))
+    session = create_session()
+    result = {'rows': rows_count}
     try:
-        csv_filepath = get_google_sheet(spreadsheet_id, files_dir)
-        generate_html_from_csv(csv_filepath, files_dir)
-        print("\nГенерація вебсайту завершена. Завантажте його на Github\n\nДля цього зробіть наступні речі:\n1.Відкрийте github.com/login та зайдіть на акаунт nd4s\n2.Відкрийте іконку справа згори та тисніть:\n- Your repositories => gs\n- Add files => Upload files\n3.Відкрийте згенеровану папку files, а у ній файл index.html \n(аби перевірити, що все працює, як треба)\n4.Якщо все вірно, то перетягніть файли з папки у Github\n5.Готово! Натисніть Commit changes та очікуйте до 5 хвилин\n\nУ разі виникнення помилок повторіть процес або зверніться до адміністратора")
+        # cold: empty output and cache; warm: the same sheet again, as in watch mode without changes
+        for run in ('cold', 'warm'):
+            trace = BuildTrace()
+            start = time.perf_counter()
+            with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+                trace.stage('sheet')
+                csv_filepath = get_google_sheet(str(rows_count), output_dir, session=session, cache=cache, trace=trace, sheet_url=sheet_url)
+                generate_html_from_csv(csv_filepath, output_dir, session=session, cache=cache, trace=trace, vendor_urls=vendor_urls, **build_options)
+                cache.save()
+            trace.finish()
+            result[run] = {
+                'seconds': round(time.perf_counter() - start, 3),
+                'stages': {event['name']: round(event['dur'] / 1000, 1) for event in trace.events if event['cat'] == 'stage'},
+            }
+    finally:
+        session.close()
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['output_bytes'] = directory_size(output_dir)
+    return result
+
+def run_benchmark(sizes=BENCH_SIZES, latency=BENCH_LATENCY, logo_size=BENCH_LOGO_SIZE, logo_count=BENCH_LOGO_COUNT,
+                  source_csv=None, results_dir=BENCH_DIR, **build_options):
+    source_csv = source_csv or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.csv')
+    # A PDF page per row would dominate every other stage at 10k rows, so it is measured only when asked for
+    build_options.setdefault('pdf', False)
+    server = start_bench_server(source_csv, latency=latency, logo_size=logo_size, logo_count=logo_count)
+    sheet_url = f"http://127.0.0.1:{server.server_port}/sheet/{{spreadsheet_id}}.csv"
+    # Nothing leaves the machine: the CDN files come from the stand-in server as well
+    vendor_urls = {name: f"http://127.0.0.1:{server.server_port}{path}" for name, path in BENCH_VENDOR_URLS.items()}
+    work_dir = tempfile.mkdtemp(prefix='gs-bench-')
+    cases = []
+    try:
+        for rows_count in sizes:
+            print(f"Бенчмарк: {rows_count} рядків...")
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                cases.append(executor.submit(run_benchmark_case, rows_count, sheet_url, vendor_urls, work_dir, build_options).result())
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    run = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'settings': {'latency': latency, 'logo_size': logo_size, 'logo_count': logo_count, 'build_options': build_options},
+        'cases': cases,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, 'results.json')
+    history = []
+    if os.path.exists(results_path):
+        with open(results_path, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    previous = next((past for past in reversed(history) if past['settings'] == run['settings']), None)
+    print(benchmark_report(run, previous))
+    history.append(run)
+    with open(results_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+    os.replace(results_path + '.tmp', results_path)
+    print(f"Результати збережено в {results_path}")
+    return run
+
+def benchmark_report(run, previous=None):
+    previous_cases = {case['rows']: case for case in previous['cases']} if previous else {}
+    lines = [f"{'рядків':>8}{'холодна, с':>12}{'тепла, с':>10}{'RSS, МБ':>9}{'вихід, МБ':>11}  зміна холодної"]
+    for case in run['cases']:
+        before = previous_cases.get(case['rows'])
+        change = f"{(case['cold']['seconds'] / before['cold']['seconds'] - 1) * 100:+.0f}%" if before else '-'
+        lines.append(f"{case['rows']:>8}{case['cold']['seconds']:>12.2f}{case['warm']['seconds']:>10.2f}"
+                     f"{case['peak_rss_mb'] if case['peak_rss_mb'] is not None else '-':>9}"
+                     f"{case['output_bytes'] / 1024 / 1024:>11.1f}  {change}")
+        slowest = sorted(case['cold']['stages'].items(), key=lambda item: -item[1])[:3]
+        lines.append(f"{'':>8}найдовші етапи: " + ', '.join(f"{name} {ms:.0f} мс" for name, ms in slowest))
+    return '\n'.join(lines)
+
+def build_batch(sites, cache, fetch_workers=FETCH_WORKERS, qr_workers=QR_WORKERS, **build_options):
+    """Builds (sheet id or CSV path, output dir) pairs side by side with one session, cache, template and worker pool."""
+    session = create_session(fetch_workers)
+    shared = SharedWork(os.path.join(cache.cache_dir, 'assets'), workers=qr_workers)
+    os.makedirs(shared.asset_dir, exist_ok=True)
+    origin = time.perf_counter()
+    def build(site):
+        source, output_dir = site
+        trace = BuildTrace(origin)
+        start = time.perf_counter()
+        error = None
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            trace.stage('sheet')
+            csv_filepath = source if os.path.isfile(source) else get_google_sheet(source, output_dir, session=session, cache=cache, trace=trace)
+            generate_html_from_csv(csv_filepath, output_dir, session=session, cache=cache, trace=trace,
+                                   qr_workers=qr_workers, fetch_workers=fetch_workers, shared=shared, **build_options)
+        except Exception as e:
+            error = str(e)
+        trace.finish()
+        return {'source': source, 'output': output_dir, 'seconds': time.perf_counter() - start, 'error': error, 'trace': trace}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(sites))) as executor:
+            results = list(executor.map(build, sites))
+    finally:
+        shared.close()
+        session.close()
+        cache.save()
+    # One Chrome trace for the whole batch, each site shown as its own process
+    combined = BuildTrace(origin)
+    for index, result in enumerate(results):
+        combined.events.append({'name': 'process_name', 'ph': 'M', 'pid': index, 'args': {'name': result['output']}})
+        combined.events.extend(dict(event, pid=index) for event in result['trace'].events)
+    combined.save(os.path.join(cache.cache_dir, TRACE_FILENAME))
+    # Each site has its own copies of the files it uses, so the shared store keeps only what some site still references;
+    # an original download swept here is copied again from the HTTP cache when a row needs it
+    manifest_rows = [load_build_manifest(output_dir).get('rows', {}).values() for _, output_dir in sites]
+    collect_garbage(shared.asset_dir, set().union(*(live_assets(rows) for rows in manifest_rows)))
+    if build_options.get('pdf', True):
+        layout_key = pdf_layout_key()
+        prune_pdf_cache(os.path.join(cache.cache_dir, 'pdf'), set().union(*(pdf_cache_files(rows, layout_key) for rows in manifest_rows)))
+    print(batch_report(results, shared, time.perf_counter() - origin))
+    return results
+
+def batch_report(results, shared, total_seconds):
+    lines = [f"\nПакетна збірка завершена за {total_seconds:.1f} с, сайтів: {len(results)}"]
+    stage_totals = defaultdict(float)
+    for result in results:
+        stages = [event for event in result['trace'].events if event['cat'] == 'stage']
+        for event in stages:
+            stage_totals[event['name']] += event['dur'] / 1000
+        slowest = max(stages, key=lambda event: event['dur'], default=None)
+        status = f"помилка: {result['error']}" if result['error'] else (f"найдовше {slowest['name']} {slowest['dur'] / 1000:.0f} мс" if slowest else '')
+        lines.append(f"{result['seconds']:>8.1f} с  {result['output']}  ({status})")
+    lines.append("Сумарний час етапів по всіх сайтах (мс):")
+    lines.extend(f"{ms:>10.0f}  {name}" for name, ms in sorted(stage_totals.items(), key=lambda item: -item[1]))
+    lines.append(f"Спільні завантаження, логотипи і QR-коди: {len(shared.futures)} виконано на {shared.requests} запитів.")
+    return '\n'.join(lines)
+
+def watch_google_sheet(spreadsheet_id, output_dir, cache, interval=WATCH_INTERVAL, csv_filepath=None, **build_options):
+    # The session, the compiled template and the caches stay warm between builds,
+    # so a change in the sheet costs only an incremental rebuild
+    session = create_session(build_options.get('fetch_workers', FETCH_CONNECTIONS_PER_HOST))
+    last_hash = None
+    print(f"Стежу за таблицею {csv_filepath or spreadsheet_id} (перевірка кожні {interval} с). Зупинити - Ctrl+C.")
+    try:
+        while True:
+            try:
+                trace = BuildTrace()
+                trace.stage('sheet')
+                sheet_path = csv_filepath or get_google_sheet(spreadsheet_id, output_dir, session=session, cache=cache, trace=trace)
+                content_hash = md5(sheet_path)
+                if content_hash != last_hash:
+                    print(f"\n[{datetime.now():%H:%M:%S}] Таблицю змінено, сайт оновлюється...")
+                    start = time.perf_counter()
+                    generate_html_from_csv(sheet_path, output_dir, session=session, cache=cache, trace=trace, **build_options)
+                    cache.save()
+                    trace.save(os.path.join(cache.cache_dir, TRACE_FILENAME))
+                    last_hash = content_hash
+                    print(trace.summary())
+                    print(f"[{datetime.now():%H:%M:%S}] Готово за {time.perf_counter() - start:.1f} с.")
+            except Exception as e:
+                print(f"\n[{datetime.now():%H:%M:%S}] Трапилася помилка, спробую ще раз: {str(e)}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nСтеження зупинено.")
+    finally:
+        session.close()
+        cache.save()
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        if name.strip() and not re.fullmatch(r'\s*q\s*=\s*0(\.0*)?\s*', params):
+            accepted.add(name.strip().lower())
+    return accepted
+
+@lru_cache(maxsize=SERVE_COMPRESSED_CACHE_SIZE)
+def preview_body(path, mtime_ns, encoding, live_reload):
+    # Keyed on the file's mtime, so a rebuilt file is read and compressed again; the same levels as write_compressed_variants
+    with open(path, 'rb') as f:
+        content = f.read()
+    if live_reload:
+        content = content.replace(b'</body>', LIVE_RELOAD_SCRIPT.encode() + b'\n</body>', 1)
+    if encoding == 'br':
+        return brotli.compress(content)
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=9, mtime=0)
+    return content
+
+def start_preview_server(output_dir, host=SERVE_HOST, port=SERVE_PORT):
+    """Local HTTP server for the generated site with the headers a static host would send and live reload."""
+    root = os.path.realpath(output_dir)
+    reload_state = {'version': 0}
+    reload_changed = threading.Condition()
+    manifest = {'mtime': None, 'assets': {}}
+    page_bytes = [0]
+    log_lock = threading.Lock()
+
+    def asset_info(filename):
+        manifest_path = os.path.join(root, ASSET_MANIFEST_FILENAME)
+        mtime = os.path.getmtime(manifest_path) if os.path.exists(manifest_path) else None
+        if mtime != manifest['mtime']:
+            manifest['assets'] = {}
+            if mtime:
+                with open(manifest_path, encoding='utf-8') as f:
+                    manifest['assets'] = json.load(f)
+            manifest['mtime'] = mtime
+        return manifest['assets'].get(filename, {})
+
+    def watch_for_rebuilds():
+        # index.html is published last, so its mtime changing means the whole rebuild is in place
+        index_path = os.path.join(root, 'index.html')
+        last = os.stat(index_path).st_mtime_ns if os.path.exists(index_path) else None
+        while True:
+            time.sleep(SERVE_RELOAD_POLL)
+            current = os.stat(index_path).st_mtime_ns if os.path.exists(index_path) else None
+            if current != last:
+                last = current
+                with reload_changed:
+                    reload_state['version'] += 1
+                    reload_changed.notify_all()
+                print(f"[{datetime.now():%H:%M:%S}] Сайт оновлено, відкриті сторінки перезавантажуються.")
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            start = time.perf_counter()
+            path = urlsplit(self.path).path
+            if path == LIVE_RELOAD_PATH:
+                self.stream_reload_events()
+                return
+            filename = os.path.normpath(unquote(path)).lstrip('/\\') or 'index.html'
+            file_path = os.path.realpath(os.path.join(root, filename))
+            if os.path.isdir(file_path):
+                filename = os.path.join(filename, 'index.html')
+                file_path = os.path.join(file_path, 'index.html')
+            if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+                self.send_error(404)
+                self.log_transfer(path, 404, 0, None, start)
+                return
+            sent, encoding, status = self.send_file(filename, file_path)
+            self.log_transfer(path, status, sent, encoding, start)
+
+        do_HEAD = do_GET
+
+        def send_file(self, filename, file_path):
+            stat = os.stat(file_path)
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            if content_type.startswith('text/') or content_type in ('application/json', 'application/javascript', 'image/svg+xml'):
+                content_type += '; charset=utf-8'
+            live_reload = filename == 'index.html'
+            accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+            encoding, body_path, body = None, file_path, None
+            for candidate, extension in (('br', '.br'), ('gzip', '.gz')):
+                if candidate not in accepted:
+                    continue
+                if not live_reload and os.path.exists(file_path + extension):
+                    encoding, body_path = candidate, file_path + extension
+                    break
+                if filename.endswith(COMPRESSIBLE_EXTENSIONS) and (candidate == 'gzip' or brotli):
+                    compressed = preview_body(file_path, stat.st_mtime_ns, candidate, live_reload)
+                    if len(compressed) < stat.st_size:
+                        encoding, body = candidate, compressed
+                        break
+            if body is None and live_reload and encoding is None:
+                body = preview_body(file_path, stat.st_mtime_ns, None, True)
+            size = len(body) if body is not None else os.path.getsize(body_path)
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+            immutable = asset_info(filename.replace(os.sep, '/')).get('immutable')
+            status = 304 if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')] else 200
+            self.send_response(status)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', SERVE_IMMUTABLE_CACHE_CONTROL if immutable else 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            if status == 304:
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return 0, encoding, status
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(size))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            if self.command == 'HEAD':
+                return 0, encoding, status
+            if body is not None:
+                self.wfile.write(body)
+            else:
+                with open(body_path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile, DOWNLOAD_CHUNK_SIZE)
+            return size, encoding, status
+
+        def stream_reload_events(self):
+            with reload_changed:
+                version = reload_state['version']
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                while True:
+                    with reload_changed:
+                        reload_changed.wait_for(lambda: reload_state['version'] != version, timeout=SERVE_KEEPALIVE)
+                        changed = reload_state['version'] != version
+                        version = reload_state['version']
+                    # The comment line keeps proxies from closing an idle stream and notices closed tabs
+                    self.wfile.write(f"event: reload\ndata: {version}\n\n".encode() if changed else b": ping\n\n")
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+
+        def log_transfer(self, path, status, sent, encoding, start):
+            # Bytes since the last index.html add up to what one page load costs a visitor
+            with log_lock:
+                if path in ('/', '/index.html'):
+                    page_bytes[0] = 0
+                page_bytes[0] += sent
+                print(f"{self.command} {path} {status} {sent / 1024:.1f} КБ{' ' + encoding if encoding else ''} "
+                      f"{(time.perf_counter() - start) * 1000:.1f} мс | сторінка {page_bytes[0] / 1024:.0f} КБ")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=watch_for_rebuilds, daemon=True).start()
+    return server
+
+def serve_site(output_dir, cache, host=SERVE_HOST, port=SERVE_PORT, watch_interval=None, spreadsheet_id=DEFAULT_SPREADSHEET_ID, csv_filepath=None, **build_options):
+    server = start_preview_server(output_dir, host=host, port=port)
+    print(f"Сайт доступний на http://{host}:{server.server_port}/ (тека {output_dir}). Зупинити - Ctrl+C.")
+    try:
+        if watch_interval:
+            watch_google_sheet(spreadsheet_id, output_dir, cache, interval=watch_interval, csv_filepath=csv_filepath, **build_options)
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        print("\nСервер зупинено.")
+
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"потрібне ціле число, більше за 0: {value}")
+    return number
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Генератор сторінки-каталогу можливостей з Google Таблиці. Без команди виконується build.")
+
+    def add_cache_options(command, defaults=True):
+        command.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR if defaults else argparse.SUPPRESS, help="тека кешу (типово .cache поруч зі скриптом)")
+        command.add_argument('--cache-size', type=int, default=CACHE_MAX_BYTES // (1024 * 1024) if defaults else argparse.SUPPRESS, help="найбільший розмір кешу, МБ")
+
+    # Accepted before and after the command; the copy on each command only overrides what was given to it
+    add_cache_options(parser)
+    common = argparse.ArgumentParser(add_help=False)
+    add_cache_options(common, defaults=False)
+    commands = parser.add_subparsers(dest='command')
+
+    def add_build_options(command, single_site=True):
+        if single_site:
+            source = command.add_mutually_exclusive_group()
+            source.add_argument('--sheet-id', default=DEFAULT_SPREADSHEET_ID, help="ідентифікатор Google Таблиці")
+            source.add_argument('--csv', help="шлях до локального CSV замість Google Таблиці")
+            command.add_argument('--output', default=DEFAULT_OUTPUT_DIR, help="тека, куди генерується сайт")
+        command.add_argument('--fetch-workers', type=positive_int, default=FETCH_WORKERS, help="потоків для скачування картинок")
+        command.add_argument('--qr-workers', type=positive_int, default=QR_WORKERS, help="процесів для QR-кодів і логотипів")
+        command.add_argument('--qr-format', choices=('png', 'svg', 'inline'), default=QR_FORMAT)
+        command.add_argument('--shard-size', type=positive_int, help="рядків в одному файлі з описами (сторінка довантажує їх за потреби)")
+        command.add_argument('--no-pdf', dest='pdf', action='store_false', help="не створювати PDF")
+        command.add_argument('--quarantine', help="переносити невикористані файли в цю теку замість видалення")
+        command.add_argument('--offline', action='store_true', help="збирати лише з кешу, без запитів у мережу")
+
+    build = commands.add_parser('build', parents=[common], help="згенерувати сайт (типова команда)")
+    add_build_options(build)
+    build.add_argument('--profile', action='store_true', help="звіт cProfile і tracemalloc після збірки")
+    watch = commands.add_parser('watch', parents=[common], help="перезбирати сайт, коли таблиця змінюється")
+    add_build_options(watch)
+    watch.add_argument('interval', nargs='?', type=int, default=WATCH_INTERVAL, help="секунд між перевірками")
+    batch = commands.add_parser('batch', parents=[common], help="зібрати кілька сайтів разом зі спільним кешем і пулом процесів")
+    batch.add_argument('--site', nargs=2, action='append', required=True, metavar=('ТАБЛИЦЯ', 'ТЕКА'),
+                       help="ідентифікатор Google Таблиці або шлях до CSV і тека сайту; можна повторювати")
+    add_build_options(batch, single_site=False)
+    bench = commands.add_parser('bench', parents=[common], help="бенчмарк на локальному сервері з синтетичними таблицями")
+    bench.add_argument('sizes', nargs='*', type=int, default=list(BENCH_SIZES), help="кількості рядків")
+    bench.add_argument('--latency', type=float, default=BENCH_LATENCY, help="затримка відповіді сервера, с")
+    bench.add_argument('--logo-size', type=int, default=BENCH_LOGO_SIZE, help="розмір логотипів, px")
+    bench.add_argument('--logos', type=int, default=BENCH_LOGO_COUNT, help="кількість різних логотипів")
+    bench.add_argument('--pdf', action='store_true', help="вимірювати і створення PDF")
+    clean = commands.add_parser('clean', parents=[common], help="очистити кеш (результати бенчмарків лишаються)")
+    clean.add_argument('--output', help="також видалити цю теку зі згенерованим сайтом")
+    commands.add_parser('cache-stats', parents=[common], help="статистика кешу")
+    serve = commands.add_parser('serve', parents=[common], help="переглянути сайт через локальний HTTP-сервер з автоперезавантаженням")
+    add_build_options(serve)
+    serve.add_argument('--host', default=SERVE_HOST)
+    serve.add_argument('--port', type=int, default=SERVE_PORT)
+    serve.add_argument('--watch', nargs='?', type=int, const=WATCH_INTERVAL, metavar='СЕКУНД',
+                       help="також перезбирати сайт, коли таблиця змінюється (типово кожні 60 с)")
+    return parser
+
+def build_options_from_args(args):
+    return {
+        'qr_workers': args.qr_workers,
+        'fetch_workers': args.fetch_workers,
+        'qr_format': args.qr_format,
+        'shard_size': args.shard_size,
+        'pdf': args.pdf,
+        'quarantine_dir': args.quarantine,
+    }
+
+def clean_cache(cache_dir, output_dir=None):
+    removed = 0
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name == os.path.basename(BENCH_DIR):
+                continue  # benchmark history is kept for comparisons
+            path = os.path.join(cache_dir, name)
+            removed += directory_size(path) if os.path.isdir(path) else os.path.getsize(path)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    if output_dir and os.path.isdir(output_dir):
+        removed += directory_size(output_dir)
+        shutil.rmtree(output_dir)
+        shutil.rmtree(os.path.normpath(output_dir) + '.staging', ignore_errors=True)
+    print(f"Очищено {removed / 1024 / 1024:.1f} МБ.")
+
+CLI_COMMANDS = ('build', 'watch', 'batch', 'bench', 'clean', 'cache-stats', 'serve')
+CLI_TOP_LEVEL_OPTIONS = ('--cache-dir', '--cache-size')  # the options accepted before the command, each takes a value
+
+def with_default_command(argv):
+    # The command is the first token that is neither a top-level option nor its value;
+    # anything else there (a build option or nothing at all) means build, as the script always did without arguments
+    index = 0
+    while index < len(argv):
+        token = argv[index]
+        if token in CLI_TOP_LEVEL_OPTIONS:
+            index += 2
+        elif token.startswith(tuple(option + '=' for option in CLI_TOP_LEVEL_OPTIONS)):
+            index += 1
+        elif token in CLI_COMMANDS or token in ('-h', '--help'):
+            return argv
+        else:
+            break
+    return argv[:index] + ['build'] + argv[index:]
+
+def main(argv=None):
+    argv = with_default_command(list(sys.argv[1:] if argv is None else argv))
+    args = build_arg_parser().parse_args(argv)
+    command = args.command
+    cache_max_bytes = args.cache_size * 1024 * 1024
+    if command == 'clean':
+        clean_cache(args.cache_dir, args.output)
+        return 0
+    if command == 'bench':
+        run_benchmark(sizes=args.sizes, latency=args.latency, logo_size=args.logo_size, logo_count=args.logos, pdf=args.pdf,
+                      results_dir=os.path.join(args.cache_dir, os.path.basename(BENCH_DIR)))
+        return 0
+    cache = HttpCache(args.cache_dir, max_bytes=cache_max_bytes, offline=getattr(args, 'offline', False))
+    if command == 'cache-stats':
+        print(cache.report())
+        return 0
+    if command == 'batch':
+        results = build_batch(args.site, cache, **build_options_from_args(args))
+        print(cache.report())
+        return 1 if any(result['error'] for result in results) else 0
+    os.makedirs(args.output, exist_ok=True)
+    if command == 'watch':
+        watch_google_sheet(args.sheet_id, args.output, cache, interval=args.interval, csv_filepath=args.csv, **build_options_from_args(args))
+        return 0
+    if command == 'serve':
+        serve_site(args.output, cache, host=args.host, port=args.port, watch_interval=args.watch, spreadsheet_id=args.sheet_id, csv_filepath=args.csv, **build_options_from_args(args))
+        return 0
+    session = create_session(args.fetch_workers)
+    trace = BuildTrace()
+    try:
+        with build_profile(cache.cache_dir) if args.profile else nullcontext():
+            trace.stage('sheet')
+            csv_filepath = args.csv or get_google_sheet(args.sheet_id, args.output, session=session, cache=cache, trace=trace)
+            generate_html_from_csv(csv_filepath, args.output, session=session, cache=cache, trace=trace, **build_options_from_args(args))
+        print("\nГенерація вебсайту завершена. Завантажте його на Github\n\nДля цього зробіть наступні речі:\n1.Відкрийте github.com/login та зайдіть на акаунт nd4s\n2.Відкрийте іконку справа згори та тисніть:\n- Your repositories => gs\n- Add files => Upload files\n3.Запустіть python new59_demo.py serve і відкрийте http://127.0.0.1:8000 \n(аби перевірити, що все працює, як треба)\n4.Якщо все вірно, то перетягніть файли з папки у Github\n5.Готово! Натисніть Commit changes та очікуйте до 5 хвилин\n\nУ разі виникнення помилок повторіть процес або зверніться до адміністратора")
     except Exception as e:
-        print(f"\nТрапилася наступна помилка. Зверніться з цим текстом до адміністратора: {str(e)}")
\ No newline at end of file
+        print(f"\nТрапилася наступна помилка. Зверніться з цим текстом до адміністратора: {str(e)}")
+        return 1
+    finally:
+        session.close()
+        cache.save()
+        print(cache.report())
+        trace.finish()
+        trace.save(os.path.join(cache.cache_dir, TRACE_FILENAME))
+        print(trace.summary())
+        print(f"Трасування збережено в {os.path.join(cache.cache_dir, TRACE_FILENAME)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())